@@ -2,6 +2,7 @@ from typing import ByteString
 from numpy.core.fromnumeric import shape
 from numpy.core.multiarray import array
 import zerorpc
+import gevent
 import logging
 
 import clr
@@ -11,6 +12,8 @@ import psutil
 import threading
 import signal
 import time
+import ctypes
+from collections import deque
 # import numpy as np
 from array import array
 # from System.IO import *
@@ -21,23 +24,56 @@ clr.AddReference('PrincetonInstruments.LightFieldViewV5')
 clr.AddReference('PrincetonInstruments.LightField.AutomationV5')
 clr.AddReference('PrincetonInstruments.LightFieldAddInSupportServices')
 
-from System import String, Array
+from System import String, Array, Buffer
+from System.Runtime.InteropServices import GCHandle, GCHandleType
 clr.AddReference('System.Collections')
 from System.Collections.Generic import List
 
 # PI imports
 from PrincetonInstruments.LightField.Automation import Automation
 from PrincetonInstruments.LightField.AddIns import SpectrometerSettings, ExperimentSettings, CameraSettings
-from PrincetonInstruments.LightField.AddIns import DeviceType
+from PrincetonInstruments.LightField.AddIns import DeviceType, ImageDataFormat, ShutterTimingMode
 
 
 
 
+class FrameStream:
+    """Frames received from LightField, waiting to be sent to a client.
+
+    Frames are put on the stream by LightField's event thread and taken off by the zerorpc
+    server. The queue is bounded: if the client can't keep up, the oldest frame waiting is
+    dropped to make room for the new one, so the client always gets the most recent frames.
+    """
+
+    def __init__(self, size):
+        self.frames = deque(maxlen=size)
+        self.lock = threading.Lock()
+        self.dropped = 0
+        self.completed = False
+
+    def put(self, frame):
+        with self.lock:
+            if len(self.frames) == self.frames.maxlen:
+                self.dropped += 1
+            self.frames.append(frame)
+
+    def get(self):
+        with self.lock:
+            return self.frames.popleft() if self.frames else None
+
+
 class APIController:
 
     # background process name(s) if needed to cleanup
     LIGHTFIELD_PROCESS_NAME = ["AddInProcess.exe"]
 
+    # little-endian numpy dtype strings for each of the LightField pixel formats
+    FRAME_DTYPES = {
+        ImageDataFormat.MonochromeUnsigned16: "<u2",
+        ImageDataFormat.MonochromeUnsigned32: "<u4",
+        ImageDataFormat.MonochromeFloating32: "<f4"
+    }
+
 
     
     def __init__(self):
@@ -53,6 +89,13 @@ class APIController:
         self.experiment_running = False
         self.ready_to_run = False
 
+        # bumped whenever a setting changes, so clients can tell if their cached settings are stale
+        self.settings_version = 0
+        # whether each setting exists for the current devices, so Exists is only asked once
+        self.settings_exist = {}
+        # streams of frames being sent to clients as LightField acquires them
+        self.frame_streams = []
+
     def start_lightfield(self, visible):
         logging.debug("Starting Lightfield Software")
         if self.lightfield_running:
@@ -90,6 +133,8 @@ class APIController:
 
         self.experiment.ExperimentUpdating += self.event_experiment_updating
         self.experiment.ExperimentUpdated += self.event_experiment_updated
+        self.experiment.SettingChanged += self.event_setting_changed
+        self.experiment.ImageDataSetReceived += self.event_image_data_received
 
         self.application.LightFieldClosing += self.event_lightfield_closing
 
@@ -120,6 +165,52 @@ class APIController:
         else:
             logging.debug("Cannot set %s: Either Lightfield is not running, or that setting does not exist", setting)
 
+    def _setting_exists(self, setting):
+        if setting not in self.settings_exist:
+            self.settings_exist[setting] = self.experiment.Exists(setting)
+        return self.settings_exist[setting]
+
+    def get_experiment_values(self, settings):
+        """Get a batch of experiment settings.
+
+        Returns a dict of the values that were read, and a dict of error messages for those
+        that could not be.
+        """
+        values = {}
+        errors = {}
+        if not self.lightfield_running:
+            return values, {setting: "Lightfield is not running" for setting in settings}
+        for setting in settings:
+            try:
+                if self._setting_exists(setting):
+                    values[setting] = self.experiment.GetValue(setting)
+                else:
+                    errors[setting] = "Setting does not exist"
+            except Exception as err:
+                errors[setting] = str(err)
+        return values, errors
+
+    def set_experiment_values(self, settings):
+        """Apply a batch of experiment settings, given as a dict of setting: value.
+
+        Returns a list of the settings that were applied, and a dict of error messages for
+        those that were not.
+        """
+        applied = []
+        errors = {}
+        if not self.lightfield_running:
+            return applied, {setting: "Lightfield is not running" for setting in settings}
+        for setting, value in settings.items():
+            try:
+                if self._setting_exists(setting):
+                    self.experiment.SetValue(setting, value)
+                    applied.append(setting)
+                else:
+                    errors[setting] = "Setting does not exist"
+            except Exception as err:
+                errors[setting] = str(err)
+        return applied, errors
+
     def save_experiment(self, experiment_name=None):
         if self.lightfield_running:
             logging.debug("Saving Experiment")
@@ -149,7 +240,7 @@ class APIController:
 
         return ready_to_run
 
-    def acquire_data(self, num_frames=0):
+    def acquire_data(self, num_frames=0, binary=False):
         if self.check_ready_for_acquire():
             if num_frames < 1:
                 self.experiment.Acquire()
@@ -157,13 +248,25 @@ class APIController:
             else:
                 logging.debug("Beginning acquisition of %d frames", num_frames)
                 data = self.experiment.Capture(num_frames) # returns IImageDataSetContractToViewHostAdapter?
-                extracted_data = self.get_file_data(data)
+                if binary:
+                    extracted_data = self.get_file_data_binary(data)
+                else:
+                    extracted_data = self.get_file_data(data)
                 return extracted_data
 
     def preview(self):
         if self.check_ready_for_acquire():
             self.experiment.Preview()
         
+    def open_frame_stream(self, size):
+        stream = FrameStream(size)
+        self.frame_streams.append(stream)
+        return stream
+
+    def close_frame_stream(self, stream):
+        if stream in self.frame_streams:
+            self.frame_streams.remove(stream)
+
 
     def stop_acquire(self):
         if self.lightfield_running:
@@ -209,6 +312,68 @@ class APIController:
         }
         # return raw_data
 
+    def get_file_data_binary(self, file):
+        """Extract every frame and region of interest of the file as raw little-endian bytes.
+
+        The regions of each frame are stacked on top of each other, with narrower regions
+        padded on the right with zeros, and the frames are stacked into a single
+        (frames, rows, columns) block. The pixel data of each region is copied out of the pinned
+        .NET array in one go, rather than element by element, and returned with the dtype, shape
+        and strides needed to rebuild the array on the client side without any per-element work.
+        """
+        num_frames = int(file.Frames)
+        num_regions = len(file.Regions)
+
+        first_image = file.GetFrame(0, 0)
+        dtype = self.FRAME_DTYPES[first_image.Format]
+        item_size = int(dtype[2:])
+
+        region_shapes = []
+        for region in range(num_regions):
+            image_data = first_image if region == 0 else file.GetFrame(region, 0)
+            region_shapes.append([image_data.Height, image_data.Width])
+        img_height = sum(shape[0] for shape in region_shapes)
+        img_width = max(shape[1] for shape in region_shapes)
+
+        chunks = []
+        for frame in range(num_frames):
+            for region, (region_height, region_width) in enumerate(region_shapes):
+                image_data = file.GetFrame(region, frame)
+                region_data = self._array_to_bytes(image_data.GetData())
+                if region_width == img_width:
+                    chunks.append(region_data)
+                else:
+                    row_size = region_width * item_size
+                    padding = bytes((img_width - region_width) * item_size)
+                    for row in range(region_height):
+                        chunks.append(region_data[row * row_size:(row + 1) * row_size])
+                        chunks.append(padding)
+        data = b"".join(chunks)
+
+        logging.debug("Returning %d binary frames of dimensions: (%d, %d) from %d regions, %d bytes",
+                      num_frames, img_width, img_height, num_regions, len(data))
+        return {
+            "format": "binary",
+            "data": data,
+            "dtype": dtype,
+            "shape": [num_frames, img_height, img_width],
+            "strides": [img_height * img_width * item_size, img_width * item_size, item_size],
+            "height": img_height,
+            "width": img_width,
+            "frames": num_frames,
+            "region_shapes": region_shapes
+        }
+
+    def _array_to_bytes(self, raw_data):
+        # pin the System.Array so the GC can't move it, then copy the whole block in one go
+        num_bytes = Buffer.ByteLength(raw_data)
+        handle = GCHandle.Alloc(raw_data, GCHandleType.Pinned)
+        try:
+            address = handle.AddrOfPinnedObject().ToInt64()
+            return ctypes.string_at(address, num_bytes)
+        finally:
+            handle.Free()
+
     def create_export_settings(self, file_type):
         if self.lightfield_running:
             self.export_settings = self.file_handler.CreateExportSettings(file_type)
@@ -230,12 +395,32 @@ class APIController:
     def event_experiment_completed(self, sender, event_args):
         logging.debug("Experiment Completed")
         self.experiment_running = False
+        for stream in self.frame_streams:
+            stream.completed = True
 
     def event_experiment_updating(self, sender, event_args):
         logging.debug("Experiment Updating")
 
     def event_experiment_updated(self, sender, event_args):
         logging.debug("Experiment Updated")
+        self.settings_version += 1
+        # the devices may have changed, and with them the settings available
+        self.settings_exist = {}
+
+    def event_setting_changed(self, sender, event_args):
+        self.settings_version += 1
+
+    def event_image_data_received(self, sender, event_args):
+        if not self.frame_streams:
+            return
+        # the data set is only valid during the event, so the frames are copied out here
+        try:
+            data = self.get_file_data_binary(event_args.ImageDataSet)
+        except Exception as err:
+            logging.error("Unable to read received frames: %s", err)
+            return
+        for stream in list(self.frame_streams):
+            stream.put(data)
 
     def event_experiment_ready_to_run(self, sender, event_args):
         logging.debug("Experiment Ready To Run Changed: %s", self.experiment.IsReadyToRun)
@@ -252,6 +437,8 @@ class APIController:
 
         self.experiment.ExperimentUpdating -= self.event_experiment_updating
         self.experiment.ExperimentUpdated -= self.event_experiment_updated
+        self.experiment.SettingChanged -= self.event_setting_changed
+        self.experiment.ImageDataSetReceived -= self.event_image_data_received
 
         self.application.LightFieldClosing -= self.event_lightfield_closing
         
@@ -260,11 +447,31 @@ class APIController:
         self.experiment = None
         self.file_handler = None
         # self.application = None
+        self.settings_exist = {}
+        for stream in self.frame_streams:
+            stream.completed = True
 
         self.lightfield_running = False
 
 class RPCServer:
 
+    # how often a frame stream checks for new frames from LightField, in seconds
+    STREAM_POLL_INTERVAL = 0.005
+
+    REGION_TYPES = ["FullSensor", "BinnedSensor", "LineSensor", "CustomRegions"]
+
+    # short names for the settings most often used, for get_settings and apply_settings
+    SETTINGS = {
+        "exposure": CameraSettings.ShutterTimingExposureTime,
+        "grating": SpectrometerSettings.GratingSelected,
+        "centre_wavelength": SpectrometerSettings.GratingCenterWavelength,
+        "binning_mode": CameraSettings.ReadoutControlRegionsOfInterestSelection,
+        "row_bin_centre": CameraSettings.ReadoutControlRegionsOfInterestLineSensorRowBinning,
+        "bin_width": CameraSettings.ReadoutControlRegionsOfInterestBinnedSensorXBinning,
+        "bin_height": CameraSettings.ReadoutControlRegionsOfInterestBinnedSensorYBinning,
+        "sensor_temperature": CameraSettings.SensorTemperatureReading
+    }
+
     def __init__(self):
         self.api = APIController()
 
@@ -297,6 +504,30 @@ class RPCServer:
             value
         )
 
+    def set_shutter_closed(self, closed):
+        """Hold the shutter closed, e.g. while taking dark frames, or return it to normal
+        operation"""
+        mode = ShutterTimingMode.AlwaysClosed if closed else ShutterTimingMode.Normal
+        return self.api.set_experiment_value(
+            CameraSettings.ShutterTimingMode,
+            mode
+        )
+
+    def get_shutter_mode(self):
+        """Get the shutter timing mode, as the number of the ShutterTimingMode, so that it can
+        be put back after the shutter has been held closed"""
+        mode = self.api.get_experiment_value(
+            CameraSettings.ShutterTimingMode
+        )
+        return None if mode is None else int(mode)
+
+    def set_shutter_mode(self, mode):
+        """Set the shutter timing mode, by the number of the ShutterTimingMode"""
+        return self.api.set_experiment_value(
+            CameraSettings.ShutterTimingMode,
+            mode
+        )
+
     def get_grating(self):
         """Get the currently selected grating"""
         return self.api.get_experiment_value(
@@ -316,15 +547,9 @@ class RPCServer:
             value
         )
 
-    def get_calibration_x_axis(self):
-        """Get the X Axis Calibration of the grating"""
-        return self.api.get_experiment_value(
-            ExperimentSettings.AcquisitionCalibrationsXAxes
-        )
-
     def get_region_of_interest(self):
         """Get the currently selected form of binning and/or the region of interest selected"""
-        region_enum = ["FullSensor", "BinnedSensor", "LineSensor", "CustomRegions"]
+        region_enum = self.REGION_TYPES
         region = self.api.get_experiment_value(
             CameraSettings.ReadoutControlRegionsOfInterestSelection
         )
@@ -335,7 +560,7 @@ class RPCServer:
 
     def set_region_of_interest(self, value):
         """Set the method of binning"""
-        region_enum = ["FullSensor", "BinnedSensor", "LineSensor", "CustomRegions"]
+        region_enum = self.REGION_TYPES
         if value in region_enum:
             value_num = region_enum.index(value)
 
@@ -389,12 +614,66 @@ class RPCServer:
     # calibration info
 
     def get_calibration_x_axis(self):
-        return self.api.get_experiment_value(
+        """Get the X Axis Calibration of the grating: the wavelength, in nm, of each column.
+        Returned as a list, as the .NET array can't be sent as it is"""
+        axis = self.api.get_experiment_value(
             ExperimentSettings.AcquisitionCalibrationsXAxes
         )
+        return list(axis) if axis is not None else None
 
     def get_system_column_calibration(self):
-        return self.api.get_system_column_calibration()
+        axis = self.api.get_system_column_calibration()
+        return list(axis) if axis is not None else None
+
+    def get_settings(self, names=None):
+        """Get a batch of settings in one call.
+        Arguments:
+        names -- list of settings to read, either short names from SETTINGS or full
+                 LightField setting names. Defaults to all of SETTINGS
+        Returns a dict with the "values" read, and the "errors" for any that could not be,
+        both keyed by the names asked for"""
+        if names is None:
+            names = list(self.SETTINGS)
+        lookup = {self.SETTINGS.get(name, name): name for name in names}
+
+        values, errors = self.api.get_experiment_values(list(lookup))
+        values = {lookup[setting]: value for setting, value in values.items()}
+        errors = {lookup[setting]: error for setting, error in errors.items()}
+
+        if values.get("binning_mode"):
+            # -1 cause the enum starts at 1, but the list is 0 indexed
+            values["binning_mode"] = self.REGION_TYPES[values["binning_mode"] - 1]
+        return {"values": values, "errors": errors}
+
+    def apply_settings(self, settings):
+        """Apply a batch of settings in one call.
+        Arguments:
+        settings -- dict of setting: value, keyed by short names from SETTINGS or full
+                    LightField setting names
+        Returns a dict with the list of settings "applied", and the "errors" for any that
+        could not be"""
+        lookup = {}
+        values = {}
+        errors = {}
+        for name, value in settings.items():
+            if name == "binning_mode":
+                if value not in self.REGION_TYPES:
+                    errors[name] = "{} not a region type, available types are: {}".format(
+                        value, self.REGION_TYPES)
+                    continue
+                value = self.REGION_TYPES.index(value) + 1
+            setting = self.SETTINGS.get(name, name)
+            lookup[setting] = name
+            values[setting] = value
+
+        applied, set_errors = self.api.set_experiment_values(values)
+        errors.update({lookup[setting]: error for setting, error in set_errors.items()})
+        return {"applied": [lookup[setting] for setting in applied], "errors": errors}
+
+    def get_settings_version(self):
+        """Get a counter that goes up every time an experiment setting is changed, from here or
+        from the LightField UI. Lets clients cheaply check whether cached settings are still valid"""
+        return self.api.settings_version
 
     def start_acquire(self, num_frames=0):
         """Start the acquisition. if num_frames is set above 0, this will return the data.
@@ -403,6 +682,44 @@ class RPCServer:
         data = self.api.acquire_data(num_frames)
         return data
 
+    def start_acquire_binary(self, num_frames=1):
+        """Capture num_frames frames in a single acquisition and return them all, stacked into
+        one block of raw bytes with the dtype, shape and strides needed to rebuild it. Much
+        cheaper to transfer than the list returned by start_acquire, which only holds the first
+        frame. Like start_acquire, this blocks until the acquisition is completed"""
+        data = self.api.acquire_data(num_frames, binary=True)
+        return data
+
+    @zerorpc.stream
+    def stream_frames(self, mode="preview", queue_size=4):
+        """Start a preview (or with mode="acquire", an acquisition) and send each frame as
+        LightField delivers it, in the same format as start_acquire_binary plus a count of the
+        frames dropped so far. Up to queue_size frames are held for a slow client, after which
+        the oldest are dropped. The stream ends when the experiment stops, and stopping the
+        stream early stops the experiment."""
+        if not self.api.check_ready_for_acquire():
+            logging.debug("Cannot stream frames: experiment is not ready to run")
+            return
+        stream = self.api.open_frame_stream(queue_size)
+        try:
+            if mode == "acquire":
+                self.api.acquire_data(0)
+            else:
+                self.api.preview()
+            while True:
+                frame = stream.get()
+                if frame is not None:
+                    yield dict(frame, dropped=stream.dropped)
+                elif stream.completed:
+                    break
+                else:
+                    # LightField events arrive on their own thread, which can't wake the server
+                    gevent.sleep(self.STREAM_POLL_INTERVAL)
+        finally:
+            self.api.close_frame_stream(stream)
+            if not stream.completed:
+                self.api.stop_acquire()
+
     def stop_acquire(self):
         self.api.stop_acquire()
 
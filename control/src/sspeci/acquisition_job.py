@@ -0,0 +1,85 @@
+import time
+
+
+class AcquisitionJob:
+    """
+    A list of acquisition steps, run back to back by the adapter.
+
+    Each step gives the settings to take its frames with, the number of frames, and options
+    for processing them, e.g.
+        {"settings": {"exposure": 100.0, "centre_wavelength": 550.0}, "frames": 10,
+         "options": {"correct": true, "accumulate": true, "peaks": true, "file": "a.h5"}}
+    Only the settings that differ from the step before are written, so a sweep of one setting
+    costs one write per step. Options that aren't given are left as they are: correct and
+    peaks turn dark correction and peak fitting on or off, accumulate accumulates the frames
+    of the step from scratch, and file writes them to an HDF5 file in the data directory,
+    closing it at the end of the step unless it was already open before the step.
+
+    The job records its progress and the result of each step, to be reported by the adapter.
+    """
+
+    OPTIONS = ("correct", "accumulate", "peaks", "file")
+
+    def __init__(self, job_id, steps, setting_names):
+        """
+        job_id: number identifying the job
+        steps: list of the steps of the job
+        setting_names: names of the settings a step can change
+        raises: ValueError if the steps aren't valid
+        """
+        if not isinstance(steps, list) or not steps:
+            raise ValueError("A job must be a list of at least one step")
+        self.job_id = job_id
+        self.steps = [self.parse_step(index, step, setting_names)
+                      for index, step in enumerate(steps)]
+        self.status = "queued"
+        self.current_step = None
+        self.frames_acquired = 0
+        self.results = []
+        self.error = None
+        self.cancelled = False
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+
+    @classmethod
+    def parse_step(cls, index, step, setting_names):
+        if not isinstance(step, dict):
+            raise ValueError("Step {} must be an object".format(index))
+        unknown = set(step) - {"settings", "frames", "options"}
+        if unknown:
+            raise ValueError("Unknown fields in step {}: {}".format(index, ", ".join(unknown)))
+
+        settings = step.get("settings", {})
+        if not isinstance(settings, dict) or set(settings) - set(setting_names):
+            raise ValueError("Step {} settings must be an object of {}".format(
+                index, ", ".join(setting_names)))
+        frames = step.get("frames", 1)
+        # bool is an int, but true frames is a mistake rather than 1
+        if not isinstance(frames, int) or isinstance(frames, bool) or frames < 1:
+            raise ValueError("Step {} frames must be a positive integer".format(index))
+        options = step.get("options", {})
+        if not isinstance(options, dict) or set(options) - set(cls.OPTIONS):
+            raise ValueError("Step {} options must be an object of {}".format(
+                index, ", ".join(cls.OPTIONS)))
+        return {"settings": dict(settings), "frames": frames, "options": dict(options)}
+
+    @property
+    def total_frames(self):
+        return sum(step["frames"] for step in self.steps)
+
+    def describe(self):
+        """Summarise the job and its progress, for the parameter tree."""
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "step": self.current_step,
+            "steps": len(self.steps),
+            "frames_acquired": self.frames_acquired,
+            "total_frames": self.total_frames,
+            "submitted": self.submitted,
+            "started": self.started,
+            "finished": self.finished,
+            "error": self.error,
+            "results": self.results
+        }
@@ -0,0 +1,223 @@
+import asyncio
+import logging
+import time
+import uuid
+
+import msgpack
+import zmq
+import zmq.asyncio
+
+from zerorpc.exceptions import (LostRemote, TimeoutExpired, RemoteError)
+
+# version of the zerorpc protocol spoken, the same as zerorpc 0.6
+PROTOCOL_VERSION = 3
+
+
+class _Channel:
+    """The replies to one call, collected by the client's receive loop."""
+
+    def __init__(self):
+        self.replies = asyncio.Queue()
+        self.last_seen = time.monotonic()
+        # time the caller stops waiting for the next reply, None if it waits as long as the
+        # server is alive
+        self.deadline = None
+
+    def put(self, name, args):
+        self.replies.put_nowait((name, args))
+
+    def fail(self, error):
+        self.replies.put_nowait((None, error))
+
+    async def get(self):
+        name, args = await self.replies.get()
+        if name is None:
+            raise args
+        return name, args
+
+
+class AsyncZeroRPCClient:
+    """
+    zerorpc client for use on the asyncio event loop.
+
+    Speaks the zerorpc wire protocol over a zmq.asyncio DEALER socket, so calls are awaited
+    rather than blocking the thread (and every other adapter) until the bridge replies. Any
+    number of calls can be in flight at once: each one is given its own channel, and a single
+    receive loop hands the replies out to them.
+
+    Methods are called as with zerorpc.Client, with an optional per-call timeout:
+        version = await client.get_settings_version()
+        frames = await client.start_acquire_binary(10, timeout=300)
+
+    Stream methods are iterated over with stream:
+        async for frame in client.stream("stream_frames", "preview"):
+
+    The same exceptions as zerorpc.Client are raised, so callers handle errors in the same way.
+    """
+
+    def __init__(self, endpoint=None, timeout=30, heartbeat=5):
+        """
+        endpoint: zmq endpoint of the zerorpc server, can also be given to connect
+        timeout: default time in seconds to wait for a reply, None to wait forever
+        heartbeat: interval in seconds between heartbeats. The server gives up on a call if it
+        hears nothing for two of its own heartbeat intervals (5 seconds by default), so this
+        should be no longer than the server's. A call waiting as long as the server is alive
+        fails once it hears nothing for two intervals, but a call with a timeout is left to
+        run out its timeout, as the server sends no heartbeats while it is blocked, e.g. by
+        a long capture
+        """
+        self.endpoint = None
+        self.timeout = timeout
+        self.heartbeat = heartbeat
+        self.context = zmq.asyncio.Context.instance()
+        self.socket = None
+        self.channels = {}
+        self.tasks = []
+        self.msg_id_base = uuid.uuid4().hex[8:]
+        self.msg_id_counter = 0
+        if endpoint:
+            self.connect(endpoint)
+
+    def connect(self, endpoint):
+        self.endpoint = endpoint
+        self.socket = self.context.socket(zmq.DEALER)
+        self.socket.setsockopt(zmq.LINGER, 0)
+        self.socket.connect(endpoint)
+
+    def close(self):
+        for task in self.tasks:
+            task.cancel()
+        self.tasks = []
+        for channel in self.channels.values():
+            channel.fail(LostRemote("Client closed"))
+        self.channels.clear()
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+
+    def __getattr__(self, method):
+        if method.startswith('_'):
+            raise AttributeError(method)
+        return lambda *args, **kwargs: self(method, *args, **kwargs)
+
+    async def __call__(self, method, *args, timeout=False):
+        """
+        Call a method on the server and wait for its result.
+        method: name of the method
+        args: arguments to pass to the method
+        timeout: time in seconds to wait for the reply, defaults to the client's timeout
+        """
+        timeout = self.timeout if timeout is False else timeout
+        channel_id, channel = await self._open_channel(method, args)
+        if timeout is not None:
+            channel.deadline = time.monotonic() + timeout
+        try:
+            name, args = await asyncio.wait_for(channel.get(), timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutExpired(timeout, "calling remote method {}".format(method))
+        finally:
+            self.channels.pop(channel_id, None)
+
+        if name == 'OK':
+            return args[0]
+        if name == 'ERR':
+            raise RemoteError(*args)
+        raise RemoteError("ProtocolError", "Unexpected reply {} to {}".format(name, method), None)
+
+    async def stream(self, method, *args, timeout=None, prefetch=1):
+        """
+        Call a zerorpc stream method on the server, yielding each item as it arrives.
+        method: name of the method
+        args: arguments to pass to the method
+        timeout: time in seconds to wait for each item, defaults to waiting as long as the
+        server is alive
+        prefetch: number of items the server may send ahead of the one being handled. The
+        server waits for room before sending more, so a slow consumer holds it back rather
+        than building up a queue here
+        """
+        channel_id, channel = await self._open_channel(method, args)
+        # the server starts out allowed to send a single item
+        open_slots = 1
+        try:
+            while True:
+                if timeout is not None:
+                    channel.deadline = time.monotonic() + timeout
+                try:
+                    name, args = await asyncio.wait_for(channel.get(), timeout)
+                except asyncio.TimeoutError:
+                    raise TimeoutExpired(timeout, "streaming remote method {}".format(method))
+
+                if name == 'STREAM':
+                    open_slots -= 1
+                    if open_slots < prefetch:
+                        await self._send(self._new_msg_id(), '_zpc_more',
+                                         (prefetch - open_slots,), channel_id)
+                        open_slots = prefetch
+                    yield args
+                elif name == 'STREAM_DONE':
+                    return
+                elif name == 'ERR':
+                    raise RemoteError(*args)
+                else:
+                    raise RemoteError("ProtocolError",
+                                      "Unexpected reply {} to {}".format(name, method), None)
+        finally:
+            self.channels.pop(channel_id, None)
+
+    async def _open_channel(self, method, args):
+        if self.socket is None:
+            raise LostRemote("Client is not connected")
+        if not self.tasks:
+            # started on first use, as the client may be created before the event loop runs
+            self.tasks = [asyncio.ensure_future(self._receive()),
+                          asyncio.ensure_future(self._send_heartbeats())]
+        channel_id = self._new_msg_id()
+        channel = self.channels[channel_id] = _Channel()
+        await self._send(channel_id, method, args)
+        return channel_id, channel
+
+    def _new_msg_id(self):
+        self.msg_id_counter = (self.msg_id_counter + 1) % 0x100000000
+        return '{0:08x}{1}'.format(self.msg_id_counter, self.msg_id_base).encode()
+
+    async def _send(self, message_id, name, args, response_to=None):
+        header = {'message_id': message_id, 'v': PROTOCOL_VERSION}
+        if response_to is not None:
+            header['response_to'] = response_to
+        await self.socket.send_multipart(
+            [b'', msgpack.packb((header, name, args), use_bin_type=True)])
+
+    async def _receive(self):
+        while True:
+            frames = await self.socket.recv_multipart()
+            try:
+                header, name, args = msgpack.unpackb(frames[-1], raw=False)
+            except (ValueError, msgpack.ExtraData) as err:
+                logging.error("Invalid zerorpc message received: %s", err)
+                continue
+
+            channel = self.channels.get(header.get('response_to'))
+            if channel is None:
+                # a late reply to a call that has timed out, or a heartbeat after its result
+                continue
+            channel.last_seen = time.monotonic()
+            # heartbeats only keep the channel alive, and flow control is ignored as every
+            # reply is queued as soon as it arrives
+            if name not in ('_zpc_hb', '_zpc_more'):
+                channel.put(name, args)
+
+    async def _send_heartbeats(self):
+        while True:
+            await asyncio.sleep(self.heartbeat)
+            now = time.monotonic()
+            for channel_id, channel in list(self.channels.items()):
+                within_timeout = channel.deadline is not None and now < channel.deadline
+                if now - channel.last_seen > self.heartbeat * 2 and not within_timeout:
+                    self.channels.pop(channel_id, None)
+                    channel.fail(LostRemote("Lost remote after {}s heartbeat".format(
+                        self.heartbeat * 2)))
+                    continue
+                try:
+                    await self._send(self._new_msg_id(), '_zpc_hb', (0,), channel_id)
+                except zmq.ZMQError as err:
+                    logging.error("Unable to send zerorpc heartbeat: %s", err)
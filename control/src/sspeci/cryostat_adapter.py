@@ -1,13 +1,12 @@
 from builtins import FileNotFoundError
+import asyncio
 import logging
 from multiprocessing import connection
 import sys
 import os
 import json
-from urllib import response
+import re
 from xmlrpc.client import FastMarshaller
-import requests
-from requests.exceptions import ConnectionError, Timeout
 
 import time
 
@@ -15,34 +14,45 @@ import time
 # from odin_data.ipc_channel import IpcChannel, IpcChannelException
 # from odin_data.ipc_message import IpcMessage, IpcMessageException
 
-from odin.adapters.adapter import (ApiAdapter, ApiAdapterRequest,
+from odin.adapters.adapter import (ApiAdapterRequest,
                                    ApiAdapterResponse, request_types, response_types)
-from odin.adapters.parameter_tree import ParameterTree, ParameterTreeError
+from odin.adapters.async_adapter import AsyncApiAdapter
+from odin.adapters.async_parameter_tree import AsyncParameterTree
+from odin.adapters.parameter_tree import ParameterTreeError
 from odin.util import decode_request_body
 
 # from cryostat_libs import cryocore, instrument
 
-from tornado.httpclient import HTTPClient, HTTPRequest, HTTPClientError
-from tornado.escape import json_decode
+from tornado.httpclient import HTTPClientError
+from tornado.escape import json_decode, json_encode, utf8
 from tornado.ioloop import PeriodicCallback
 
+from sspeci.history_buffer import HistoryBuffer
+from sspeci.http_pool import KeepAliveHTTPClient
+from sspeci.telemetry_store import TelemetryError, TelemetryStore
 
 
-class CryostatAdapter(ApiAdapter):
+class CryostatAdapter(AsyncApiAdapter):
 
 
     def __init__(self, **kwargs):
         super(CryostatAdapter, self).__init__(**kwargs)
 
-        logging.getLogger('urllib3').setLevel(logging.WARNING)  # stops debug spam from "connectionpool"
-
         self.cryo_ip = self.options.get("ip", "127.0.0.1")
         # use_tunnel = self.options.get("tunnel", False)
         self.cryo_port = self.options.get("port", 47101)
         self.power_schedule_directory = self.options.get("power_schedule_dir", "power_schedules")
+        # most requests the cryostat is sent at once, and connections kept open to it
+        poll_concurrency = int(self.options.get("poll_concurrency", 8))
+        # most readings of the temperatures, heater powers and pressure kept in the history,
+        # which is sampled once a second whatever the poll rates, so a week by default
+        history_length = int(self.options.get("history_length", 7 * 24 * 3600))
+        # database the readings are stored in across restarts, none if empty
+        telemetry_file = self.options.get("telemetry_file", "cryostat_telemetry.db")
         # self.cryo = cryocore.CryoCore(self.cryo_ip, tunnel=use_tunnel)
-        self.cryo = CryoClient(self.cryo_ip, self.cryo_port, self.power_schedule_directory)
-        self.param_tree = ParameterTree({
+        self.cryo = CryoClient(self.cryo_ip, self.cryo_port, self.power_schedule_directory,
+                               poll_concurrency, history_length, telemetry_file)
+        self.param_tree = AsyncParameterTree({
             "cryo_ip_addr": (self.cryo_ip, None),
             "stage1": {
                 "temperature": (lambda: self.cryo.stage1_current_temp, None),
@@ -85,29 +95,52 @@ class CryostatAdapter(ApiAdapter):
                 "can_pull_vacuum": (lambda: self.cryo.can_pull_vac, None),
                 "can_warmup": (lambda: self.cryo.can_warmup, None),
                 "can_vent": (lambda: self.cryo.can_vent, None)
+            },
+            "connection": {
+                "connected": (lambda: self.cryo.cryo_connected, None),
+                "connections_opened": (lambda: self.cryo.http_client.connections_opened, None),
+                "connections_idle": (lambda: len(self.cryo.http_client.idle), None),
+                "requests": (lambda: self.cryo.http_client.requests, None),
+                "requests_reused": (lambda: self.cryo.http_client.requests_reused, None)
+            },
+            "telemetry": {
+                "file": (telemetry_file, None),
+                "readings_written": (lambda: self.cryo.telemetry_stat("readings_written"), None),
+                "readings_dropped": (lambda: self.cryo.telemetry_stat("readings_dropped"), None),
+                "error": (lambda: self.cryo.telemetry_stat("error"), None)
             }
         })
 
     @response_types('application/json', default='application/json')
-    def get(self, path, request):
+    async def get(self, path, request):
         try:
-            response = self.param_tree.get(path)
+            path_elems = re.split('[/?#]', path)
+            if path_elems[0] == 'history':
+                response = self.cryo.history.query(*self.get_history_args(request))
+            elif path_elems[0] == 'telemetry':
+                response = await self.get_telemetry(request)
+            else:
+                response = await self.param_tree.get(path)
             content_type = 'application/json'
             status = 200
         except ParameterTreeError as param_error:
             response = {'response': 'ZeroRPC GET error: {}'.format(param_error)}
             content_type = 'application/json'
             status = 400
+        except (ValueError, TelemetryError) as history_err:
+            response = {'response': 'Cryostat history GET error: {}'.format(history_err)}
+            content_type = 'application/json'
+            status = 400
 
         return ApiAdapterResponse(response, content_type=content_type, status_code=status)
 
     @response_types('application/json', default='application/json')
-    def put(self, path, request):
+    async def put(self, path, request):
         try:
             data = decode_request_body(request)
-            self.param_tree.set(path, data)
+            await self.param_tree.set(path, data)
 
-            response = self.param_tree.get(path)
+            response = await self.param_tree.get(path)
             content_type = 'application/json'
             status = 200
 
@@ -118,6 +151,34 @@ class CryostatAdapter(ApiAdapter):
 
         return ApiAdapterResponse(response, content_type=content_type, status_code=status)
 
+    def get_history_args(self, request):
+        """
+        Get the history asked for by the query arguments of a request: channels, a comma
+        separated list of the channels to get, defaulting to all of them, start and end, the
+        span of time to get in seconds since the epoch or counting back if negative, and
+        max_points, the number of points to downsample to, defaulting to 500.
+        returns: (channels, start, end, max_points)
+        """
+        args = {name: values[0].decode() for name, values in request.query_arguments.items()}
+        channels = args["channels"].split(",") if args.get("channels") else None
+        try:
+            start = float(args["start"]) if "start" in args else None
+            end = float(args["end"]) if "end" in args else None
+            max_points = min(max(int(args.get("max_points", 500)), 1), 100000)
+        except ValueError:
+            raise ValueError("History start and end must be numbers, and max_points an integer")
+        return channels, start, end, max_points
+
+    async def get_telemetry(self, request):
+        # the readings stored across restarts, queried on the store's thread
+        if self.cryo.telemetry is None:
+            raise TelemetryError("No telemetry file is configured")
+        return await asyncio.wrap_future(
+            self.cryo.telemetry.query(*self.get_history_args(request)))
+
+    async def cleanup(self):
+        self.cryo.close()
+
 class CryoClient:
 
     properties = {
@@ -127,16 +188,71 @@ class CryoClient:
         "sample_stage": "/sampleChamber/temperatureControllers/user1"
     }
 
-    def __init__(self, ip, port, schedule_dir):
+    # temperature controllers, in the order of the temp_stabilities and heater_power lists
+    stages = ("sample", "stage1", "stage2")
+
+    # properties polled from the cryostat, keyed by the name they are stored under, with the
+    # path to read and how often to read it in seconds. Temperatures change quickly, while
+    # settings only change when they are written, which reads them back, and bakeout settings
+    # hardly change at all. Thermometer, heater and vacuum gauge samples hold several values,
+    # and are unpacked by _store_property
+    poll_properties = {
+        "system_goal": (properties["system_goal"], 1),
+        "system_state": ("controller/properties/systemState", 1),
+        "vacuum_sample":
+            ("vacuumSystem/vacuumGauges/sampleChamberPressure/properties/pressureSample", 1),
+        "power_limit": (properties["sample_stage"] + "/properties/userPowerLimit", 5),
+        "user_controller_enabled":
+            (properties["sample_stage"] + "/properties/controllerEnabled", 5),
+        "bakeout_enabled": ("controller/properties/platformBakeoutEnabled", 30),
+        "bakeout_temp": ("controller/properties/platformBakeoutTemperature", 30),
+        "bakeout_time": ("controller/properties/platformBakeoutTime", 30),
+        "can_abort": ("controller/properties/canAbortGoal", 5),
+        "can_cooldown": ("controller/properties/canCooldown", 5),
+        "can_pull_vac": ("controller/properties/canPullVacuum", 5),
+        "can_vent": ("controller/properties/canVent", 5),
+        "can_warmup": ("controller/properties/canWarmup", 5),
+        "sample_thermometer": (properties["sample_stage"] + "/thermometer/properties/sample", .25),
+        "stage1_thermometer": (properties["stage1_props"] + "/thermometer/properties/sample", .25),
+        "stage2_thermometer": (properties["stage2_props"] + "/thermometer/properties/sample", .25),
+        "sample_heater": (properties["sample_stage"] + "/heater/properties/sample", 1),
+        "stage1_heater": (properties["stage1_props"] + "/heater/properties/sample", 1),
+        "stage2_heater": (properties["stage2_props"] + "/heater/properties/sample", 1),
+        "sample_target_temp": (properties["sample_stage"] + "/properties/targetTemperature", 5),
+        "stage1_target_temp": (properties["stage1_props"] + "/properties/targetTemperature", 5),
+        "stage2_target_temp": (properties["stage2_props"] + "/properties/targetTemperature", 5)
+    }
+
+    # channels recorded in the history, read from the thermometers, heaters and vacuum gauge
+    history_channels = tuple(
+        "{}_{}".format(stage, value) for stage in stages
+        for value in ("temperature", "stability", "heater_power")) + ("vacuum_pressure",)
+
+    def __init__(self, ip, port, schedule_dir, concurrency=8, history_length=604800,
+                 telemetry_file=None):
         # self.client = HTTPClient()
-        self.addr = "http://{ip}:{port}/{version}".format(ip=ip, port=port, version="v1")
+        self.addr = "/{version}".format(version="v1")
 
-        self.request_headers = {
-            'Content-Type': 'application/json',
-            'Accept': 'application/json',
-        }
         self.schedule_dir = schedule_dir
+        # polls give up quickly, so a slow cryostat doesn't hold up the next one, but writes and
+        # method calls are given time to finish, as they may take effect even if they time out
         self.timeout = .05
+        self.write_timeout = 5
+        # every read, write and method call shares one pool of connections kept open to the
+        # cryostat, so polls don't pay for a new connection each time. Requests are sent
+        # without blocking the IOLoop, with at most concurrency in flight at once
+        self.http_client = KeepAliveHTTPClient(ip, port, concurrency, self.timeout)
+        # the channels are sampled into the history at a fixed interval, however often they
+        # are polled, each with the latest value read since the last sample, if any
+        self.history = HistoryBuffer(self.history_channels, history_length)
+        self.history_interval = 1
+        self.history_readings = {}
+        self.history_due = 0
+        # every poll of the channels is written to the telemetry database, if there is one, to
+        # be kept across restarts
+        self.telemetry = None
+        if telemetry_file:
+            self.telemetry = TelemetryStore(telemetry_file, self.history_channels)
         # store values locally to avoid hammering the cryostat with requests
         self.cryo_connected = False
 
@@ -187,110 +303,136 @@ class CryoClient:
         self.selected_schedule = "default.json"
         logging.debug("Power Lookup: %s", self.power_lookup )
 
-        prop_loop = PeriodicCallback(self.get_all_properties, 1000)
-        prop_loop.start()
-
-
-    def get_all_properties(self):
-        # looping method to refresh all locally stored values
-        try:
-            start_time = time.time()
-            with requests.Session() as s: # using session means it only has to init one HTTP connection each time this is called
-                self.system_goal = self._get_prop(self.properties['system_goal'], s)
-                self.system_state = self._get_prop("controller/properties/systemState", s)
-                
-                userstage_sample = self._get_prop("/".join([self.properties['sample_stage'], "thermometer/properties/sample"]), s)
-                stage1_sample    = self._get_prop("/".join([self.properties['stage1_props'], "thermometer/properties/sample"]), s)
-                stage2_sample    = self._get_prop("/".join([self.properties['stage2_props'], "thermometer/properties/sample"]), s)
-
-                self.sample_current_temp = userstage_sample['temperature']
-                self.stage1_current_temp = stage1_sample['temperature']
-                self.stage2_current_temp = stage2_sample['temperature']
-
-                self.temp_stabilities = [userstage_sample['temperatureStability'],
-                                        stage1_sample['temperatureStability'],
-                                        stage2_sample['temperatureStability']]
-
-                user_heater_sample = self._get_prop("/".join([self.properties['sample_stage'], "heater/properties/sample"]), s)
-                stage1_heater_sample = self._get_prop("/".join([self.properties['stage1_props'], "heater/properties/sample"]), s)
-                stage2_heater_sample = self._get_prop("/".join([self.properties['stage2_props'], "heater/properties/sample"]), s)
-
-                self.heater_power = [user_heater_sample['power'], stage1_heater_sample['power'], stage2_heater_sample['power']]
-
-
-                self.sample_target_temp = self._get_prop("/".join([self.properties['sample_stage'], "properties/targetTemperature"]), s)
-                self.stage1_target_temp = self._get_prop("/".join([self.properties['stage1_props'], "properties/targetTemperature"]), s)
-                self.stage2_target_temp = self._get_prop("/".join([self.properties['stage2_props'], "properties/targetTemperature"]), s)
-
-                self.power_limit = self._get_prop("/".join([self.properties['sample_stage'], "properties/userPowerLimit"]))
-                self.user_controller_enabled = self._get_prop("/".join([self.properties['sample_stage'], "properties/controllerEnabled"]))
-
-
-
-                vacuum_sample = self._get_prop("vacuumSystem/vacuumGauges/sampleChamberPressure/properties/pressureSample", s)
-                self.vacuum_pressure = vacuum_sample['pressure']
-
-                self.bakeout_enabled = self._get_prop("controller/properties/platformBakeoutEnabled", s)
-                self.bakeout_temp = self._get_prop("controller/properties/platformBakeoutTemperature", s)
-                self.bakeout_time = self._get_prop("controller/properties/platformBakeoutTime", s)
-
-                self.can_abort = self._get_prop("controller/properties/canAbortGoal", s)
-                self.can_cooldown = self._get_prop("controller/properties/canCooldown", s)
-                self.can_pull_vac = self._get_prop("controller/properties/canPullVacuum", s)
-                self.can_vent = self._get_prop("controller/properties/canVent", s)
-                self.can_warmup = self._get_prop("controller/properties/canWarmup", s)
-                if self.power_schedule_enabled:
-                    planned_power = self.get_power_from_lookup()
-                    logging.debug("Planned Power: %f", planned_power)
-                    self.set_power_limit(planned_power)
-                    self.power_limit = planned_power
-
-        except (Timeout, ConnectionError):
-            self.cryo_connected = False
-            logging.error("TIMEOUT OR CONNECTION ERROR OH NO")
+        # when each property is next due to be read, and the property read from each address,
+        # so that a write can have it read back straight away
+        self.poll_due = dict.fromkeys(self.poll_properties, 0)
+        self.poll_names = {self._url_construct(path): name
+                           for name, (path, _) in self.poll_properties.items()}
+        self.poll_tick = min(interval for _, interval in self.poll_properties.values())
+        self.prop_loop = PeriodicCallback(self.get_due_properties, self.poll_tick * 1000)
+        self.prop_loop.start()
+
+    def close(self):
+        self.prop_loop.stop()
+        self.http_client.close()
+        if self.telemetry is not None:
+            self.telemetry.stop()
+
+    def telemetry_stat(self, name):
+        return getattr(self.telemetry, name) if self.telemetry is not None else None
+
+    async def get_due_properties(self):
+        # looping method to refresh the locally stored values that are due to be read. A
+        # property is due if it will be by the middle of the next tick, so that one read every
+        # tick isn't put back a tick by the loop running slightly early
+        now = time.time()
+        names = [name for name, due in self.poll_due.items() if due <= now + self.poll_tick / 2]
+        if names:
+            await self.get_properties(names)
+
+    async def get_all_properties(self):
+        await self.get_properties(list(self.poll_properties))
+
+    async def get_properties(self, names):
+        # reads the named properties and stores their values. The reads are all sent at once,
+        # so the batch takes about as long as the slowest read rather than the sum of them
+        start_time = time.time()
+        for name in names:
+            self.poll_due[name] = start_time + self.poll_properties[name][1]
+        results = await asyncio.gather(
+            *(self._get_prop(self.poll_properties[name][0]) for name in names),
+            return_exceptions=True)
+
+        # a failed read only loses that property, the rest are still stored
+        errors = []
+        readings = {}
+        for name, result in zip(names, results):
+            try:
+                if isinstance(result, Exception):
+                    raise result
+                self._store_property(name, result, readings)
+            except (HTTPClientError, OSError, KeyError, TypeError, ValueError) as err:
+                errors.append((name, err))
+        # samples are due on a fixed schedule, with the same slack as the polls, so they don't
+        # drift later by a tick each time
+        self.history_readings.update(readings)
+        if self.history_readings and start_time >= self.history_due - self.poll_tick / 2:
+            self.history.append(start_time, self.history_readings)
+            self.history_readings = {}
+            self.history_due = max(self.history_due + self.history_interval,
+                                   start_time + self.history_interval / 2)
+        if readings and self.telemetry is not None:
+            self.telemetry.append(start_time, readings)
+        if errors:
+            logging.error("Failed to read %d of %d cryostat properties, first %s: %s",
+                          len(errors), len(names), errors[0][0], errors[0][1])
+        self.cryo_connected = len(errors) < len(names)
+
+        # the power limit follows the sample temperature, and is only written when it changes
+        if (self.cryo_connected and self.power_schedule_enabled and
+                "sample_thermometer" in names):
+            planned_power = self.get_power_from_lookup()
+            logging.debug("Planned Power: %f", planned_power)
+            if planned_power != self.power_limit:
+                await self.set_power_limit(planned_power)
+                self.power_limit = planned_power
 
         end_time = time.time()
         logging.debug("Time Taken to get properties: %fs", end_time - start_time)
 
+    def _store_property(self, name, value, readings):
+        # readings collects the values of the history channels
+        stage, _, kind = name.partition("_")
+        if kind == "thermometer":
+            temperature = value['temperature']
+            stability = value['temperatureStability']
+            setattr(self, stage + "_current_temp", temperature)
+            self.temp_stabilities[self.stages.index(stage)] = stability
+            readings[stage + "_temperature"] = temperature
+            readings[stage + "_stability"] = stability
+        elif kind == "heater":
+            self.heater_power[self.stages.index(stage)] = value['power']
+            readings[stage + "_heater_power"] = value['power']
+        elif name == "vacuum_sample":
+            self.vacuum_pressure = value['pressure']
+            readings["vacuum_pressure"] = value['pressure']
+        else:
+            setattr(self, name, value)
 
-    def _get_prop(self, prop, session=None):
+    async def _get_prop(self, prop):
         # logging.debug("GET PROP: %s", prop)
         full_addr = self._url_construct(prop)
 
-        if session:
-            response = session.get(full_addr, timeout=self.timeout)
-        else:
-            response = requests.get(full_addr, timeout=self.timeout)
-        
+        response = await self.http_client.fetch(full_addr)
+
         # get the last part of the address to simplify the reponse dict
-        last_addr_part = prop.split("/")[-1] 
-        return json_decode(response.text)[last_addr_part]
+        last_addr_part = prop.split("/")[-1]
+        return json_decode(response.body)[last_addr_part]
 
-    def _set_prop(self, prop, value):
+    async def _set_prop(self, prop, value):
         full_addr = self._url_construct(prop)
-        last_addr_part = prop.split("/")[-1] 
-        # request = HTTPRequest(full_addr, method="PUT", body=value)
-        # response = self.client.fetch(request)
+        last_addr_part = prop.split("/")[-1]
 
-        response = requests.put(full_addr, json={last_addr_part: value})
+        response = await self.http_client.fetch(
+            full_addr, "PUT", utf8(json_encode({last_addr_part: value})), self.write_timeout)
 
-        if 200 <= response.status_code < 300:
+        if 200 <= response.code < 300:
             logging.debug("set_prop successful")
+        # read the property back on the next tick rather than waiting for its next poll
+        if full_addr in self.poll_names:
+            self.poll_due[self.poll_names[full_addr]] = 0
 
-        # return json_decode(response.text)
+        # return json_decode(response.body)
 
-    def _call_method(self, path, param=None):
+    async def _call_method(self, path, param=None):
 
         full_addr = self._url_construct(path)
-        last_addr_part = path.split("/")[-1] 
-        # request = HTTPRequest(full_addr, method="POST")
-        if param:
-            response = requests.post(full_addr, json=param)
-        else:
-            response = requests.post(full_addr)
-        
+        body = utf8(json_encode(param)) if param else None
+        response = await self.http_client.fetch(full_addr, "POST", body, self.write_timeout)
+        # a method can change the state of the whole cryostat, so read everything on the next tick
+        self.poll_due = dict.fromkeys(self.poll_due, 0)
 
-        return json_decode(response.text)
+        return json_decode(response.body)
 
     def _url_construct(self, path):
 
@@ -299,117 +441,118 @@ class CryoClient:
 
         return "{}/{}".format(self.addr, path)
 
-    def set_sample_target_temp(self, value):
+    async def set_sample_target_temp(self, value):
         try:
             full_addr = "/".join([self.properties['sample_stage'], "properties/targetTemperature"])
 
-            self._set_prop(full_addr, value)
+            await self._set_prop(full_addr, value)
 
-        except (Timeout, ConnectionError):
+        except (HTTPClientError, OSError):
             logging.debug("Set Target Temp Failed: ")
 
     #potentially dont use the stage1 & stage2 stuff, leave that on auto?
-    def set_stage1_target_temp(self, value):
+    async def set_stage1_target_temp(self, value):
         logging.warning("Changing the details of the cryostat Stages is not recommended")
         try:
             full_addr = "/".join([self.properties['stage1_props'], "properties/targetTemperature"])
 
-            self._set_prop(full_addr, value)
+            await self._set_prop(full_addr, value)
 
-        except (Timeout, ConnectionError):
+        except (HTTPClientError, OSError):
             logging.debug("Set Target Temp Failed: ")
 
-    def set_stage2_target_temp(self, value):
+    async def set_stage2_target_temp(self, value):
         logging.warning("Changing the details of the cryostat Stages is not recommended")
         try:
             full_addr = "/".join([self.properties['stage2_props'], "properties/targetTemperature"])
 
-            self._set_prop(full_addr, value)
+            await self._set_prop(full_addr, value)
 
-        except (Timeout, ConnectionError):
+        except (HTTPClientError, OSError):
             logging.debug("Set Target Temp Failed: ")
 
-    def set_bakeout_enable(self, value):
+    async def set_bakeout_enable(self, value):
         try:
-            self._set_prop("controller/properties/platformBakeoutEnabled", value)
+            await self._set_prop("controller/properties/platformBakeoutEnabled", value)
         
-        except (Timeout, ConnectionError):
+        except (HTTPClientError, OSError):
             logging.error("Set Bakeout Enabled Failed")
 
-    def set_bakeout_temp(self, value):
+    async def set_bakeout_temp(self, value):
         try:
-            self._set_prop("controller/properties/platformBakeoutTemperature", value)
+            await self._set_prop("controller/properties/platformBakeoutTemperature", value)
 
-        except (Timeout, ConnectionError):
+        except (HTTPClientError, OSError):
             logging.error("Set Bakeout Enabled Failed")
 
-    def set_bakeout_time(self, value):
+    async def set_bakeout_time(self, value):
         try:
-            self._set_prop("controller/properties/platformBakeoutTime", value)
-        except (Timeout, ConnectionError):
+            await self._set_prop("controller/properties/platformBakeoutTime", value)
+        except (HTTPClientError, OSError):
             logging.error("Set Bakeout Time Failed")
 
-    def set_power_limit(self, value):
+    async def set_power_limit(self, value):
         try:
-            self._set_prop("/".join([self.properties["sample_stage"], "properties/userPowerLimit"]), value)
-        except (Timeout, ConnectionError):
+            await self._set_prop(
+                "/".join([self.properties["sample_stage"], "properties/userPowerLimit"]), value)
+        except (HTTPClientError, OSError):
             logging.error("Set Power Limit Failed")
 
-    def set_controller_enabled(self, value):
+    async def set_controller_enabled(self, value):
         try:
-            self._set_prop("/".join([self.properties['sample_stage'], "properties/controllerEnabled"]), value)
-        except (Timeout, ConnectionError):
+            await self._set_prop(
+                "/".join([self.properties['sample_stage'], "properties/controllerEnabled"]), value)
+        except (HTTPClientError, OSError):
             logging.error("Set Controller Enabled Failed")
 
-
     # cryostat Methods
 
-    def begin_cooldown(self, _):
+    async def begin_cooldown(self, _):
         if self.can_cooldown:
             try:
                 addr = "controller/methods/cooldown()"
-                self._call_method(addr)
-            except (Timeout, ConnectionError):
+                await self._call_method(addr)
+            except (HTTPClientError, OSError):
                 logging.debug("Cooldown begin Failed")
         else:
             logging.debug("Cannot Begin Cooldown")
 
-    def abort_goal(self, _):
+    async def abort_goal(self, _):
         if self.can_abort:
             try:
                 addr = "controller/methods/abortGoal()"
-                self._call_method(addr)
-            except (Timeout, ConnectionError):
+                await self._call_method(addr)
+            except (HTTPClientError, OSError):
                 logging.debug("Abort Goal Failed")
         else:
             logging.debug("Cannot Abort")
 
-    def vent(self, _):
+    async def vent(self, _):
         if self.can_vent:
             try:
                 addr = "controller/methods/vent()"
-                self._call_method(addr)
-            except (Timeout, ConnectionError):
+                await self._call_method(addr)
+            except (HTTPClientError, OSError):
                 logging.debug("Vent Failed")
         else:
             logging.debug("Cannot Vent")
 
-    def pull_vacuum(self, _):
+    async def pull_vacuum(self, _):
         if self.can_pull_vac:
             try:
                 addr = "controller/methods/pullVacuum()"
-                self._call_method(addr)
-            except (Timeout, ConnectionError):
+                await self._call_method(addr)
+            except (HTTPClientError, OSError):
                 logging.debug("Vacuum Pull Failed")
         else:
             logging.debug("Cannot Pull Vacuum")
 
-    def warmup(self, _):
+    async def warmup(self, _):
         if self.can_warmup:
             try:
                 addr = "controller/methods/warmup()"
-                self._call_method(addr)
-            except (Timeout, ConnectionError):
+                await self._call_method(addr)
+            except (HTTPClientError, OSError):
                 logging.debug("warmup begin Failed")
         else:
             logging.debug("Cannot Warmup")
@@ -0,0 +1,74 @@
+import logging
+
+import numpy as np
+
+
+class FrameAccumulator:
+    """
+    Running mean and variance of a series of frames, for co-adding weak signals.
+
+    Uses Welford's algorithm in float64, applied to whole frames at a time, so only the mean,
+    the sum of squared differences and a few frame sized temporaries are ever held: memory
+    stays at the size of a frame no matter how many are accumulated. Accumulation runs until
+    target_frames have been added, or indefinitely if that is 0, and starts over if the frame
+    shape changes.
+    """
+
+    def __init__(self, target_frames=0):
+        """
+        target_frames: number of frames to accumulate, 0 to carry on until reset
+        """
+        self.target_frames = target_frames
+        self.enabled = False
+        self.reset()
+
+    def reset(self, value=None):
+        self.count = 0
+        self.mean = None
+        self.m2 = None
+        self.delta = None
+
+    @property
+    def complete(self):
+        return self.target_frames > 0 and self.count >= self.target_frames
+
+    def add(self, frames):
+        """
+        Add a stack of frames to the running mean and variance.
+        frames: 3D array of the frames, of shape (frames, height, width)
+        """
+        if self.mean is not None and self.mean.shape != frames.shape[1:]:
+            logging.debug("Frame shape changed to %s, restarting accumulation", frames.shape[1:])
+            self.reset()
+        if self.mean is None:
+            self.mean = np.zeros(frames.shape[1:], dtype=np.float64)
+            self.m2 = np.zeros(frames.shape[1:], dtype=np.float64)
+            self.delta = np.empty(frames.shape[1:], dtype=np.float64)
+
+        for frame in frames:
+            if self.complete:
+                break
+            self.count += 1
+            np.subtract(frame, self.mean, out=self.delta)
+            self.mean += self.delta / self.count
+            # the difference from the old mean times the difference from the new one
+            self.m2 += self.delta * (frame - self.mean)
+
+    def result(self):
+        """
+        Get the accumulated result.
+        returns: dict of the frame count and copies of the mean, variance (the unbiased sample
+        variance) and signal to noise ratio (mean over standard deviation, 0 where there is no
+        variance) of each pixel, or None if nothing has been accumulated
+        """
+        if not self.count:
+            return None
+        variance = self.m2 / (self.count - 1) if self.count > 1 else np.zeros_like(self.m2)
+        std = np.sqrt(variance)
+        snr = np.divide(self.mean, std, out=np.zeros_like(std), where=std > 0)
+        return {
+            "count": self.count,
+            "mean": self.mean.copy(),
+            "variance": variance,
+            "snr": snr
+        }
@@ -0,0 +1,199 @@
+import logging
+
+import numpy as np
+
+# acquisition settings recorded alongside every frame
+SETTINGS_DTYPE = np.dtype([
+    ("exposure", np.float64),
+    ("centre_wavelength", np.float64),
+    ("binning_mode", "U16"),
+    ("row_bin_centre", np.int32),
+    ("bin_width", np.int32),
+    ("bin_height", np.int32)
+])
+
+# value stored when a setting could not be read from the spectrometer
+SETTINGS_MISSING = {
+    "exposure": np.nan,
+    "centre_wavelength": np.nan,
+    "binning_mode": "",
+    "row_bin_centre": -1,
+    "bin_width": -1,
+    "bin_height": -1
+}
+
+
+class FrameBufferError(Exception):
+    """Raised when a frame that is not held in the buffer is requested."""
+
+
+class FrameBuffer:
+    """
+    Fixed capacity ring buffer of the most recently acquired frames.
+
+    The frame store and the per-frame frame number, timestamp and settings arrays are
+    allocated once, and each new frame is copied into the oldest slot. The storage is only
+    reallocated (and emptied) if the shape or type of the incoming frames changes, for
+    example when the binning mode is changed. The wavelength axis of each frame is held by
+    reference, as it is shared by every frame taken with the same settings.
+
+    Corrected (e.g. dark subtracted) copies of the frames can also be stored with them. They
+    are held in a second, float32 store alongside the raw frames, which is only allocated once
+    the first corrected frame arrives.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.frames = None
+        self.corrected = None
+        self.corrected_valid = np.zeros(capacity, dtype=bool)
+        self.frame_numbers = np.full(capacity, -1, dtype=np.int64)
+        self.timestamps = np.zeros(capacity, dtype=np.float64)
+        self.settings = np.zeros(capacity, dtype=SETTINGS_DTYPE)
+        self.wavelengths = [None] * capacity
+        self.count = 0
+        self.head = 0  # index of the slot the next frame will be written to
+
+    def _allocate(self, shape, dtype):
+        logging.debug("Allocating frame buffer for %d frames of shape %s, type %s",
+                      self.capacity, shape, dtype)
+        self.frames = np.empty((self.capacity,) + shape, dtype=dtype)
+        self.corrected = None
+        self.corrected_valid.fill(False)
+        self.frame_numbers.fill(-1)
+        self.count = 0
+        self.head = 0
+
+    def append(self, data, frame_number, timestamp, settings=None, wavelength=None):
+        """
+        Copy a frame into the buffer, overwriting the oldest one if the buffer is full.
+        data: 2D array of the frame
+        frame_number: sequence number of the frame
+        timestamp: time the frame was acquired, in seconds since the epoch
+        settings: dict of the acquisition settings the frame was taken with
+        wavelength: array of the wavelength of each column of the frame, if calibrated
+        """
+        self.extend(data[np.newaxis], frame_number, timestamp, settings, wavelength)
+
+    def extend(self, frames, first_frame_number, timestamp, settings=None, wavelength=None,
+               corrected=None):
+        """
+        Copy a stack of consecutive frames into the buffer in bulk, overwriting the oldest
+        ones as needed. If there are more frames than the buffer can hold, only the last ones
+        are kept.
+        frames: 3D array of the frames, of shape (frames, height, width)
+        first_frame_number: sequence number of the first frame in the stack
+        timestamp: time the frames were acquired, either one value for all of them or an
+        array with one value per frame
+        settings: dict of the acquisition settings the frames were taken with
+        wavelength: array of the wavelength of each column of the frames, if calibrated
+        corrected: 3D array of the corrected frames, if the frames were corrected
+        """
+        if self.frames is None or self.frames.shape[1:] != frames.shape[1:] \
+                or self.frames.dtype != frames.dtype:
+            self._allocate(frames.shape[1:], frames.dtype)
+
+        num_frames = len(frames)
+        timestamps = np.broadcast_to(timestamp, (num_frames,))
+        frame_numbers = np.arange(first_frame_number, first_frame_number + num_frames)
+        if num_frames > self.capacity:
+            frames = frames[-self.capacity:]
+            if corrected is not None:
+                corrected = corrected[-self.capacity:]
+            timestamps = timestamps[-self.capacity:]
+            frame_numbers = frame_numbers[-self.capacity:]
+            num_frames = self.capacity
+
+        # the stack is written in at most two pieces, either side of the end of the buffer
+        start = self.head
+        first_part = min(num_frames, self.capacity - start)
+        for dest, src in ((slice(start, start + first_part), slice(0, first_part)),
+                          (slice(0, num_frames - first_part), slice(first_part, num_frames))):
+            np.copyto(self.frames[dest], frames[src])
+            if corrected is not None:
+                if self.corrected is None:
+                    self.corrected = np.empty(self.frames.shape, dtype=np.float32)
+                np.copyto(self.corrected[dest], corrected[src])
+            self.corrected_valid[dest] = corrected is not None
+            self.frame_numbers[dest] = frame_numbers[src]
+            self.timestamps[dest] = timestamps[src]
+            self.wavelengths[dest] = [wavelength] * (dest.stop - dest.start)
+            for name in SETTINGS_DTYPE.names:
+                value = settings.get(name) if settings else None
+                self.settings[name][dest] = SETTINGS_MISSING[name] if value is None else value
+
+        self.head = (start + num_frames) % self.capacity
+        self.count = min(self.count + num_frames, self.capacity)
+
+    @property
+    def latest_frame_number(self):
+        if self.count == 0:
+            return None
+        return int(self.frame_numbers[(self.head - 1) % self.capacity])
+
+    @property
+    def first_frame_number(self):
+        if self.count == 0:
+            return None
+        return int(self.frame_numbers[(self.head - self.count) % self.capacity])
+
+    def _slot(self, frame_number):
+        latest = self.latest_frame_number
+        if latest is None:
+            raise FrameBufferError("No frames have been acquired")
+        if frame_number < 0:
+            # negative numbers count back from the latest frame, as with python indexing
+            frame_number = latest + 1 + frame_number
+        if not self.first_frame_number <= frame_number <= latest:
+            raise FrameBufferError("Frame {} is not in the buffer (holding frames {} to {})".format(
+                frame_number, self.first_frame_number, latest))
+        return (self.head - 1 - (latest - frame_number)) % self.capacity
+
+    def get(self, frame_number):
+        """
+        Get a single frame from the buffer.
+        frame_number: sequence number of the frame. Negative values count back from the
+        latest frame, so -1 is the latest
+        returns: dict of the frame data (a view into the buffer) and its metadata, including
+        the corrected data if the frame was corrected
+        """
+        slot = self._slot(frame_number)
+        return self._frame_record(slot)
+
+    def latest(self):
+        return self.get(-1)
+
+    def get_slice(self, start=None, stop=None):
+        """
+        Get a range of frames from the buffer, oldest first.
+        start: first frame number of the range, defaults to the oldest frame held
+        stop: frame number to stop before, defaults to after the latest frame
+        returns: list of frame records, as returned by get
+        """
+        if self.count == 0:
+            raise FrameBufferError("No frames have been acquired")
+        first = self.first_frame_number
+        end = self.latest_frame_number + 1
+        start = first if start is None else (start + end if start < 0 else start)
+        stop = end if stop is None else (stop + end if stop < 0 else stop)
+        start = max(start, first)
+        stop = min(stop, end)
+        return [self._frame_record(self._slot(number)) for number in range(start, stop)]
+
+    def _frame_record(self, slot):
+        return {
+            "frame_number": int(self.frame_numbers[slot]),
+            "timestamp": float(self.timestamps[slot]),
+            "settings": {name: self._setting(name, slot) for name in SETTINGS_DTYPE.names},
+            "wavelength": self.wavelengths[slot],
+            "corrected": self.corrected[slot] if self.corrected_valid[slot] else None,
+            "data": self.frames[slot]
+        }
+
+    def _setting(self, name, slot):
+        # report settings that couldn't be read as None, rather than the placeholder value
+        value = self.settings[name][slot].item()
+        missing = SETTINGS_MISSING[name]
+        if value == missing or (value != value and missing != missing):
+            return None
+        return value
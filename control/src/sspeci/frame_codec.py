@@ -0,0 +1,130 @@
+import io
+import json
+import logging
+import struct
+
+import numpy as np
+
+
+def decode_frames(frame_data):
+    """
+    Turn the frames returned by the LightField bridge into a numpy array.
+    frame_data: the dict returned by start_acquire or start_acquire_binary
+    returns: the frames as an array of shape (frames, height, width)
+
+    Binary frames are wrapped directly around the received bytes, so no per-element work
+    is done. The resulting array is read-only. Frames in the older list format are rebuilt
+    element by element, as before, and only ever hold a single frame.
+    """
+    if frame_data.get('format') == 'binary':
+        data = np.ndarray(shape=tuple(frame_data['shape']),
+                          dtype=np.dtype(frame_data['dtype']),
+                          buffer=frame_data['data'],
+                          strides=tuple(frame_data['strides']))
+    else:
+        data = np.array(frame_data['data'])
+        data = data.reshape([frame_data['height'], frame_data['width']])
+
+    data = data.reshape((-1,) + data.shape[-2:])
+    logging.debug("Decoded frames of shape %s, type %s", data.shape, data.dtype)
+    return data
+
+
+# content types frame data can be served as, the first is the default
+FRAME_CONTENT_TYPES = ('application/json', 'application/octet-stream', 'application/x-npy')
+
+
+def frame_to_dict(frame):
+    """Turn a frame record from the FrameBuffer into a JSON serialisable dict."""
+    frame = dict(frame)
+    frame["shape"] = list(frame["data"].shape)
+    frame["data"] = frame["data"].tolist()
+    if frame.get("wavelength") is not None:
+        frame["wavelength"] = frame["wavelength"].tolist()
+    return frame
+
+
+def encode_frames(frames, content_type):
+    """
+    Encode one or more frame records from the FrameBuffer for sending to a client.
+    frames: a frame record, or a list of them
+    content_type: one of FRAME_CONTENT_TYPES
+    returns: the encoded frame(s), as bytes, or a str for JSON
+
+    application/json gives the compact JSON form of the record(s).
+    application/x-npy gives a .npy file of the frame data, stacked into a 3D array for a list.
+    application/octet-stream gives the raw frame data, preceded by a 4 byte little-endian
+    length and then a JSON header holding the dtype, shape and strides needed to rebuild it,
+    plus the frame numbers, timestamps and wavelength axis (of the first frame, as frames
+    taken together share the same one).
+    """
+    if content_type == 'application/json':
+        if isinstance(frames, list):
+            body = {"frames": [frame_to_dict(frame) for frame in frames]}
+        else:
+            body = frame_to_dict(frames)
+        return json.dumps(body, separators=(',', ':'))
+
+    if isinstance(frames, list):
+        data = np.stack([frame["data"] for frame in frames])
+    else:
+        data = frames["data"]
+
+    if content_type == 'application/x-npy':
+        npy_file = io.BytesIO()
+        np.lib.format.write_array(npy_file, np.ascontiguousarray(data), allow_pickle=False)
+        return npy_file.getvalue()
+
+    data = np.ascontiguousarray(data)
+    records = frames if isinstance(frames, list) else [frames]
+    wavelength = records[0].get("wavelength") if records else None
+    header = json.dumps({
+        "dtype": data.dtype.str,
+        "shape": list(data.shape),
+        "strides": list(data.strides),
+        "frame_numbers": [frame["frame_number"] for frame in records],
+        "timestamps": [frame["timestamp"] for frame in records],
+        "wavelength": wavelength.tolist() if wavelength is not None else None
+    }, separators=(',', ':')).encode()
+    return struct.pack('<I', len(header)) + header + data.tobytes()
+
+
+# the per-pixel quantities of an accumulation result, in the order they are stacked
+ACCUMULATION_QUANTITIES = ("mean", "variance", "snr")
+
+
+def encode_accumulation(result, content_type, wavelength=None):
+    """
+    Encode the result of a FrameAccumulator for sending to a client.
+    result: dict returned by FrameAccumulator.result
+    content_type: one of FRAME_CONTENT_TYPES
+    wavelength: array of the wavelength of each column, if calibrated
+    returns: the encoded result, as bytes, or a str for JSON
+
+    For application/x-npy and application/octet-stream the mean, variance and SNR are stacked,
+    in that order, into a (3, height, width) float64 array. The octet-stream header holds the
+    frame count, the names of the quantities and the wavelength axis, as well as the dtype,
+    shape and strides.
+    """
+    wavelength = wavelength.tolist() if wavelength is not None else None
+    if content_type == 'application/json':
+        body = {"count": result["count"], "shape": list(result["mean"].shape),
+                "wavelength": wavelength}
+        body.update({name: result[name].tolist() for name in ACCUMULATION_QUANTITIES})
+        return json.dumps(body, separators=(',', ':'))
+
+    data = np.stack([result[name] for name in ACCUMULATION_QUANTITIES])
+    if content_type == 'application/x-npy':
+        npy_file = io.BytesIO()
+        np.lib.format.write_array(npy_file, data, allow_pickle=False)
+        return npy_file.getvalue()
+
+    header = json.dumps({
+        "dtype": data.dtype.str,
+        "shape": list(data.shape),
+        "strides": list(data.strides),
+        "count": result["count"],
+        "quantities": list(ACCUMULATION_QUANTITIES),
+        "wavelength": wavelength
+    }, separators=(',', ':')).encode()
+    return struct.pack('<I', len(header)) + header + data.tobytes()
@@ -0,0 +1,105 @@
+import logging
+from functools import partial
+
+import numpy as np
+
+
+class FrameCorrector:
+    """
+    Dark subtraction and flat field correction of frames.
+
+    Keeps a library of averaged dark frames, keyed by the settings the dark signal depends on:
+    exposure, binning mode, bin sizes and sensor temperature (rounded to temperature_step),
+    along with the frame shape. Flat fields depend on the binning but not the exposure, so are
+    kept by binning and shape. Flats are stored dark subtracted and normalised to a mean of 1,
+    so correcting a frame is a subtraction and (optionally) a division, done straight into
+    the output array.
+    """
+
+    def __init__(self, temperature_step=1.0):
+        """
+        temperature_step: resolution in degrees of the sensor temperature darks are kept for
+        """
+        self.temperature_step = temperature_step
+        self.darks = {}
+        self.flats = {}
+        self.enabled = True
+        self.flat_enabled = False
+
+    def dark_key(self, settings, shape):
+        temperature = settings.get("sensor_temperature")
+        if temperature is not None:
+            temperature = round(temperature / self.temperature_step) * self.temperature_step
+        return (settings.get("exposure"), settings.get("binning_mode"), settings.get("bin_width"),
+                settings.get("bin_height"), temperature, tuple(shape))
+
+    def flat_key(self, settings, shape):
+        return (settings.get("binning_mode"), settings.get("bin_width"),
+                settings.get("bin_height"), tuple(shape))
+
+    def add_dark(self, frame_sum, count, settings):
+        """
+        Store a dark frame in the library, replacing any taken with the same settings.
+        frame_sum: 2D array of the sum of the dark frames taken
+        count: number of frames in the sum
+        settings: dict of the acquisition settings the frames were taken with
+        """
+        key = self.dark_key(settings, frame_sum.shape)
+        self.darks[key] = (frame_sum / count).astype(np.float32)
+        logging.debug("Stored dark of %d frames for %s", count, key)
+
+    def add_flat(self, frame_sum, count, settings):
+        """
+        Store a flat field, from frames of uniform illumination. The matching dark is subtracted
+        if there is one.
+        frame_sum: 2D array of the sum of the flat frames taken
+        count: number of frames in the sum
+        settings: dict of the acquisition settings the frames were taken with
+        """
+        flat = frame_sum / count
+        dark = self.darks.get(self.dark_key(settings, frame_sum.shape))
+        if dark is not None:
+            flat -= dark
+        mean = flat.mean()
+        if mean <= 0:
+            raise ValueError("Flat field has no signal")
+        flat /= mean
+        # pixels with no response are left uncorrected rather than divided by zero
+        flat[flat <= 0] = 1
+        key = self.flat_key(settings, frame_sum.shape)
+        self.flats[key] = flat.astype(np.float32)
+        logging.debug("Stored flat of %d frames for %s", count, key)
+
+    def clear(self, value=None):
+        self.darks.clear()
+        self.flats.clear()
+
+    def correction(self, settings, shape):
+        """
+        Get the correction for frames taken with the given settings.
+        returns: a function correct(frames, out) writing the corrected frames to out, or None
+        if correction is disabled or there is no dark for the settings
+        """
+        if not self.enabled:
+            return None
+        dark = self.darks.get(self.dark_key(settings, shape))
+        if dark is None:
+            return None
+        flat = self.flats.get(self.flat_key(settings, shape)) if self.flat_enabled else None
+        return partial(self.correct, dark=dark, flat=flat)
+
+    @staticmethod
+    def correct(frames, out, dark, flat=None):
+        np.subtract(frames, dark, out=out, casting="unsafe")
+        if flat is not None:
+            np.divide(out, flat, out=out)
+
+    def describe(self):
+        """List the darks and flats held, for the parameter tree."""
+        dark_names = ("exposure", "binning_mode", "bin_width", "bin_height",
+                      "sensor_temperature", "shape")
+        flat_names = ("binning_mode", "bin_width", "bin_height", "shape")
+        return {
+            "darks": [dict(zip(dark_names, key)) for key in self.darks],
+            "flats": [dict(zip(flat_names, key)) for key in self.flats]
+        }
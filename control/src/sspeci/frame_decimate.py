@@ -0,0 +1,50 @@
+import numpy as np
+
+
+def decimate_line(y, x, max_points):
+    """
+    Reduce a line to at most max_points points for display.
+
+    The line is split into max_points / 2 equal bins, and the minimum and maximum of each bin
+    are kept, in the order they appear. Unlike plain subsampling, narrow peaks and dips are
+    never lost, so the decimated line looks the same as the full one when drawn at a width of
+    max_points / 2 pixels.
+    y: 1D array of the values
+    x: 1D array of the x positions of the values
+    max_points: largest number of points to return, at least 2
+    returns: the decimated x and y arrays, or the originals if they are short enough
+    """
+    num_points = len(y)
+    if num_points <= max_points:
+        return x, y
+    bins = max(max_points // 2, 1)
+    bin_size = -(-num_points // bins)
+    # the last bin is padded with its final value, and the padding indexes that value
+    padded = np.pad(y, (0, bins * bin_size - num_points), mode='edge').reshape(bins, bin_size)
+    low = padded.argmin(axis=1)
+    high = padded.argmax(axis=1)
+    index = np.stack([np.minimum(low, high), np.maximum(low, high)], axis=1)
+    index += (np.arange(bins) * bin_size)[:, np.newaxis]
+    index = np.minimum(index.reshape(-1), num_points - 1)
+    return x[index], y[index]
+
+
+def reduce_image(image, max_shape, reducer=np.mean):
+    """
+    Reduce an image to at most max_shape pixels by combining blocks of pixels.
+    image: 2D array of the image
+    max_shape: (height, width) the image must fit in
+    reducer: function combining each block, e.g. np.mean or np.max
+    returns: the reduced image, or the original if it already fits
+    """
+    height, width = image.shape
+    block_height = -(-height // max(max_shape[0], 1))
+    block_width = -(-width // max(max_shape[1], 1))
+    if block_height == 1 and block_width == 1:
+        return image
+    out_height = -(-height // block_height)
+    out_width = -(-width // block_width)
+    padded = np.pad(image, ((0, out_height * block_height - height),
+                            (0, out_width * block_width - width)), mode='edge')
+    blocks = padded.reshape(out_height, block_height, out_width, block_width)
+    return reducer(blocks, axis=(1, 3))
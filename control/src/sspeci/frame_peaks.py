@@ -0,0 +1,246 @@
+import logging
+
+import numpy as np
+
+# peak shapes that can be fitted
+PEAK_PROFILES = ("gaussian", "lorentzian", "voigt")
+
+FOUR_LN2 = 4 * np.log(2)
+
+
+class PeakFitter:
+    """
+    Finds and fits the peaks in line spectra.
+
+    Peaks are the local maxima standing more than threshold times the noise (the scaled median
+    absolute deviation) above the background either side of them, keeping the highest
+    max_peaks that are more than a window apart. Each peak is fitted over the window of pixels
+    around it by Levenberg-Marquardt, with every peak solved at once as a batch of small linear
+    systems, so an iteration is a handful of array operations however many peaks there are.
+    Voigt profiles are fitted as pseudo-Voigts, a weighted sum of a Gaussian and a Lorentzian
+    of the same width, which needs no special functions and is within about 1% of the true
+    profile.
+
+    The fits are warm started: a peak found within half a window of one fitted in the last
+    spectrum starts from that fit, so a peak that has barely moved converges in two or three
+    iterations. Fits are done in pixels, and the centres and widths converted to wavelengths after.
+    """
+
+    def __init__(self, profile="gaussian", max_peaks=8, threshold=5.0, window=15,
+                 max_iterations=20, tolerance=1e-5):
+        """
+        profile: peak shape, one of PEAK_PROFILES
+        max_peaks: largest number of peaks fitted in a spectrum
+        threshold: height above the baseline a peak must reach, in multiples of the noise
+        window: half width in pixels of the region each peak is fitted over
+        max_iterations: most iterations a fit is given to converge
+        tolerance: relative change in the squared residual at which a fit has converged
+        """
+        self.profile = profile
+        self.max_peaks = max_peaks
+        self.threshold = threshold
+        self.window = window
+        self.max_iterations = max_iterations
+        self.tolerance = tolerance
+        self.enabled = False
+        # fitted parameters of the last spectrum, one row of
+        # (amplitude, centre, width, offset, eta) per peak, in pixels
+        self.previous = None
+
+    def reset(self, value=None):
+        self.previous = None
+
+    def analyse(self, spectrum, wavelength=None):
+        """
+        Find and fit the peaks in a spectrum.
+        spectrum: 1D array of the spectrum
+        wavelength: array of the wavelength of each pixel, to report the peaks in if given
+        returns: dict of lists of the centre, full width at half maximum, amplitude, offset,
+        Lorentzian fraction (eta, for Voigt profiles) and RMS fit residual of each peak, in
+        order of centre, along with the iterations taken
+        """
+        spectrum = np.asarray(spectrum, dtype=np.float64)
+        noise = self.noise(spectrum)
+        peaks = self.find_peaks(spectrum, noise)
+        params = np.empty((0, 5))
+        residual = np.empty(0)
+        iterations = 0
+        if len(peaks):
+            window = np.clip(peaks[:, np.newaxis] + np.arange(-self.window, self.window + 1),
+                             0, len(spectrum) - 1)
+            x = window.astype(np.float64)
+            y = spectrum[window]
+            params, residual, iterations = self.fit(x, y, self.initial_params(x, y, peaks))
+            # noise that looked like a peak fits to one too small to have been found
+            real = params[:, 0] > self.threshold * noise
+            params = params[real]
+            residual = residual[real]
+        self.previous = params
+        return self.result(params, residual, iterations, wavelength)
+
+    def result(self, params=None, residual=None, iterations=0, wavelength=None):
+        """
+        Build the result of a fit, or an empty one if no parameters are given.
+        """
+        if params is None:
+            params = np.empty((0, 5))
+            residual = np.empty(0)
+        centre = params[:, 1]
+        width = params[:, 2]
+        if wavelength is not None:
+            pixels = np.arange(len(wavelength))
+            dispersion = np.interp(centre, pixels, np.gradient(wavelength))
+            centre = np.interp(centre, pixels, wavelength)
+            width = width * np.abs(dispersion)
+        return {
+            "count": len(params),
+            "centre": centre.tolist(),
+            "width": width.tolist(),
+            "amplitude": params[:, 0].tolist(),
+            "offset": params[:, 3].tolist(),
+            "eta": params[:, 4].tolist() if self.profile == "voigt" else [],
+            "residual": residual.tolist(),
+            "iterations": iterations
+        }
+
+    @staticmethod
+    def noise(spectrum):
+        # the median absolute deviation, scaled to the standard deviation of Gaussian noise
+        return 1.4826 * np.median(np.abs(spectrum - np.median(spectrum)))
+
+    def find_peaks(self, spectrum, noise):
+        """
+        Find the peaks in a spectrum.
+        noise: standard deviation of the noise in the spectrum
+        returns: array of the pixel index of each peak, in order
+        """
+        inner = spectrum[1:-1]
+        maxima = np.flatnonzero((inner > spectrum[:-2]) & (inner >= spectrum[2:])) + 1
+        # the height of each maximum over the background, taken as the median of a window
+        # either side of it, the higher of the two, so ripples on the tail of a large peak
+        # don't count
+        offsets = np.arange(1, self.window + 1)
+        last = len(spectrum) - 1
+        left = np.median(spectrum[np.clip(maxima[:, np.newaxis] - offsets, 0, last)], axis=1)
+        right = np.median(spectrum[np.clip(maxima[:, np.newaxis] + offsets, 0, last)], axis=1)
+        prominence = spectrum[maxima] - np.maximum(left, right)
+        maxima = maxima[prominence > self.threshold * noise]
+        # highest first, skipping any too close to a higher peak to be fitted apart from it
+        kept = []
+        for peak in maxima[np.argsort(spectrum[maxima])[::-1]]:
+            if all(abs(peak - other) > self.window for other in kept):
+                kept.append(peak)
+                if len(kept) == self.max_peaks:
+                    break
+        return np.sort(np.array(kept, dtype=np.intp))
+
+    def initial_params(self, x, y, peaks):
+        offset = y.min(axis=1)
+        amplitude = y[:, self.window] - offset
+        # the number of points above half the height is a rough full width at half maximum
+        width = np.count_nonzero(y - offset[:, np.newaxis] > amplitude[:, np.newaxis] / 2,
+                                 axis=1).astype(np.float64)
+        params = np.stack([amplitude, peaks.astype(np.float64), np.maximum(width, 1),
+                           offset, np.full(len(peaks), 0.5)], axis=1)
+
+        if self.previous is not None and len(self.previous):
+            distance = np.abs(peaks[:, np.newaxis] - self.previous[np.newaxis, :, 1])
+            nearest = distance.argmin(axis=1)
+            matched = distance[np.arange(len(peaks)), nearest] <= self.window / 2
+            params[matched] = self.previous[nearest[matched]]
+        return params
+
+    def fit(self, x, y, params):
+        """
+        Fit the peak profile to a batch of windows by Levenberg-Marquardt.
+        x: 2D array of the pixel positions of each window, one row per peak
+        y: 2D array of the spectrum in each window
+        params: 2D array of the starting (amplitude, centre, width, offset, eta) of each peak
+        returns: the fitted parameters, the RMS residual of each fit, and the iterations taken
+        """
+        free = 5 if self.profile == "voigt" else 4
+        diagonal = np.arange(free)
+        damping = np.full(len(params), 1e-3)
+        model, jacobian = self.model(x, params)
+        residual = y - model
+        cost = np.einsum('kn,kn->k', residual, residual)
+
+        iteration = 0
+        for iteration in range(1, self.max_iterations + 1):
+            jac = jacobian[..., :free]
+            hessian = np.einsum('kni,knj->kij', jac, jac)
+            gradient = np.einsum('kni,kn->ki', jac, residual)
+            hessian[:, diagonal, diagonal] *= 1 + damping[:, np.newaxis]
+            if free == 5:
+                # eta is held where it is at a limit and being pushed past it, otherwise the
+                # clipped steps slow down the convergence of everything else
+                held = (((params[:, 4] <= 0) & (gradient[:, 4] < 0)) |
+                        ((params[:, 4] >= 1) & (gradient[:, 4] > 0)))
+                hessian[held, 4, :] = 0
+                hessian[held, :, 4] = 0
+                hessian[held, 4, 4] = 1
+                gradient[held, 4] = 0
+            # the pseudo-inverse copes with degenerate windows, e.g. a flat one
+            step = np.einsum('kij,kj->ki', np.linalg.pinv(hessian), gradient)
+
+            trial = params.copy()
+            trial[:, :free] += step
+            self.constrain(trial, x)
+            trial_model, trial_jacobian = self.model(x, trial)
+            trial_residual = y - trial_model
+            trial_cost = np.einsum('kn,kn->k', trial_residual, trial_residual)
+
+            better = trial_cost < cost
+            # a step that barely changes the residual either way means the fit is at its minimum
+            change = np.abs(cost - trial_cost) / np.maximum(cost, 1e-300)
+            params[better] = trial[better]
+            jacobian[better] = trial_jacobian[better]
+            residual[better] = trial_residual[better]
+            cost[better] = trial_cost[better]
+            damping = np.where(better, damping / 10, damping * 10)
+
+            if np.all((change < self.tolerance) | (damping > 1e6)):
+                break
+        else:
+            logging.debug("Peak fits did not converge in %d iterations", self.max_iterations)
+
+        return params, np.sqrt(cost / x.shape[1]), iteration
+
+    def constrain(self, params, x):
+        # keeps each peak positive, within its window, and no narrower than a tenth of a pixel
+        params[:, 0] = np.maximum(params[:, 0], 0)
+        params[:, 1] = np.clip(params[:, 1], x[:, 0], x[:, -1])
+        params[:, 2] = np.maximum(params[:, 2], 0.1)
+        params[:, 4] = np.clip(params[:, 4], 0, 1)
+
+    def model(self, x, params):
+        """
+        Evaluate the peak profile and its derivatives.
+        returns: the profile of each window, and its Jacobian with respect to the amplitude,
+        centre, width, offset and eta of each peak
+        """
+        amplitude, centre, width, offset, eta = (params[:, i, np.newaxis] for i in range(5))
+        u = (x - centre) / width
+        gauss = lorentz = None
+        if self.profile != "lorentzian":
+            gauss = np.exp(-FOUR_LN2 * u ** 2)
+            gauss_du = -2 * FOUR_LN2 * u * gauss
+        if self.profile != "gaussian":
+            lorentz = 1 / (1 + 4 * u ** 2)
+            lorentz_du = -8 * u * lorentz ** 2
+
+        if self.profile == "gaussian":
+            shape, shape_du = gauss, gauss_du
+        elif self.profile == "lorentzian":
+            shape, shape_du = lorentz, lorentz_du
+        else:
+            shape = eta * lorentz + (1 - eta) * gauss
+            shape_du = eta * lorentz_du + (1 - eta) * gauss_du
+
+        jacobian = np.empty(x.shape + (5,))
+        jacobian[..., 0] = shape
+        jacobian[..., 1] = -amplitude * shape_du / width
+        jacobian[..., 2] = -amplitude * shape_du * u / width
+        jacobian[..., 3] = 1
+        jacobian[..., 4] = amplitude * (lorentz - gauss) if self.profile == "voigt" else 0
+        return amplitude * shape + offset, jacobian
@@ -0,0 +1,112 @@
+import json
+import logging
+
+from tornado.web import Application
+from tornado.websocket import WebSocketHandler, WebSocketClosedError
+
+
+class FrameSocketHandler(WebSocketHandler):
+    """
+    WebSocket connection to a single client that wants to be told about new frames.
+
+    Clients connect to /frames, optionally with ?mode=image to be sent each rendered image as a
+    binary message rather than a JSON notification. Only one message is ever in flight to a
+    client: while a send is in progress the newest frame is held back, replacing any older one
+    waiting, so slow clients skip frames instead of building up a queue.
+    """
+
+    def initialize(self, publisher):
+        self.publisher = publisher
+        self.send_images = False
+        self.sending = False
+        self.pending = None
+        self.frames_dropped = 0
+
+    def check_origin(self, origin):
+        # the page is served by odin-control on a different port
+        return True
+
+    def open(self):
+        self.send_images = self.get_query_argument("mode", "notify") == "image"
+        logging.debug("Frame push client connected from %s (mode: %s)",
+                      self.request.remote_ip, "image" if self.send_images else "notify")
+        self.publisher.add_client(self)
+
+    def on_close(self):
+        logging.debug("Frame push client %s disconnected, %d frames dropped",
+                      self.request.remote_ip, self.frames_dropped)
+        self.publisher.remove_client(self)
+
+    def on_message(self, message):
+        # nothing is expected from clients
+        pass
+
+    def send_frame(self, notification, image):
+        message = (image, True) if self.send_images and image else (notification, False)
+        if self.sending:
+            if self.pending is not None:
+                self.frames_dropped += 1
+            self.pending = message
+            return
+        self._write(message)
+
+    def _write(self, message):
+        try:
+            future = self.write_message(*message)
+        except WebSocketClosedError:
+            return
+        self.sending = True
+        future.add_done_callback(self._write_done)
+
+    def _write_done(self, future):
+        self.sending = False
+        if future.cancelled() or future.exception() is not None:
+            return
+        if self.pending is not None:
+            message, self.pending = self.pending, None
+            self._write(message)
+
+
+class FramePublisher:
+    """
+    Pushes new frames to connected WebSocket clients.
+
+    odin-control has no way for an adapter to add its own handlers to the main server, so the
+    WebSocket endpoint is served by a small tornado application on its own port.
+    """
+
+    def __init__(self, port, address="127.0.0.1"):
+        self.port = port
+        self.clients = set()
+        app = Application([(r"/frames", FrameSocketHandler, dict(publisher=self))])
+        self.server = app.listen(port, address)
+        logging.debug("Frame push server listening on %s:%d", address, port)
+
+    def add_client(self, client):
+        self.clients.add(client)
+
+    def remove_client(self, client):
+        self.clients.discard(client)
+
+    def publish(self, frame_number, timestamp, shape, image=None):
+        """
+        Send a new frame to every connected client.
+        frame_number: sequence number of the frame
+        timestamp: time the frame was acquired
+        shape: shape of the frame data
+        image: the rendered image, sent to clients that asked for images
+        """
+        if not self.clients:
+            return
+        notification = json.dumps({
+            "frame_number": frame_number,
+            "timestamp": timestamp,
+            "shape": list(shape)
+        })
+        for client in list(self.clients):
+            client.send_frame(notification, image)
+
+    def stop(self):
+        self.server.stop()
+        for client in list(self.clients):
+            client.close()
@@ -0,0 +1,121 @@
+import io
+import logging
+
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+from sspeci.frame_decimate import decimate_line, reduce_image
+
+logging.getLogger('matplotlib').setLevel(logging.WARNING)
+
+
+class FrameRenderer:
+    """
+    Headless renderer that turns spectrometer frames into PNG images.
+
+    One figure is kept for each plot mode (line spectrum or 2D image) and the plotted data
+    is swapped into the existing artists for every new frame, so nothing is rebuilt per
+    frame and memory stays flat over long multi-frame runs. The figures are drawn with
+    the Agg canvas directly, so pyplot and any interactive backend are never involved.
+
+    Frames are decimated to the size of the plot before they are drawn, as there is no point
+    handing matplotlib more points than there are pixels to show them: lines keep the minimum
+    and maximum of each pixel column, so peaks are never lost, and images are averaged over
+    blocks of pixels.
+    """
+
+    def __init__(self, title="Science!", size=(640, 480)):
+        """
+        title: title of the plots
+        size: default (width, height) of the images in pixels
+        """
+        self.title = title
+        self.size = size
+        self.figures = {}
+        self.artists = {}
+        self.png_buffer = io.BytesIO()
+
+    def render(self, data, wavelength=None, size=None):
+        """
+        Render a frame.
+        data: 2D array of the frame. Frames with a single row are drawn as a line spectrum
+        wavelength: array of the wavelength of each column, used for the x axis if given.
+        Otherwise the columns are plotted by pixel
+        size: (width, height) of the image in pixels, defaults to the renderer's size
+        returns: the PNG encoded image, as bytes
+        """
+        if wavelength is not None and len(wavelength) != data.shape[-1]:
+            logging.warning("Wavelength axis does not match frame width, plotting by pixel")
+            wavelength = None
+        mode = "line" if data.shape[0] == 1 else "image"
+        fig = self._get_figure(mode)
+        self._set_size(fig, size or self.size)
+        if mode == "line":
+            self._render_line(fig, data.reshape(-1), wavelength)
+        else:
+            self._render_image(fig, data, wavelength)
+
+        self.png_buffer.seek(0)
+        self.png_buffer.truncate()
+        fig.savefig(self.png_buffer, format='png')
+        return self.png_buffer.getvalue()
+
+    def _get_figure(self, mode):
+        if mode not in self.figures:
+            logging.debug("Creating figure for %s plots", mode)
+            fig = Figure()
+            FigureCanvasAgg(fig)
+            ax = fig.add_subplot()
+            ax.set_title(self.title)
+            self.figures[mode] = fig
+        return self.figures[mode]
+
+    def _set_size(self, fig, size):
+        inches = (size[0] / fig.dpi, size[1] / fig.dpi)
+        if tuple(fig.get_size_inches()) != inches:
+            fig.set_size_inches(*inches)
+
+    def _render_line(self, fig, spectrum, wavelength):
+        ax = fig.axes[0]
+        line = self.artists.get("line")
+        x_axis = wavelength if wavelength is not None else np.arange(len(spectrum))
+        x_axis, spectrum = decimate_line(spectrum, x_axis, 2 * max(int(ax.bbox.width), 1))
+
+        if line is None:
+            line, = ax.plot(x_axis, spectrum)
+            ax.set_ylabel("Intensity (Counts)")
+            self.artists["line"] = line
+        elif line.get_xdata() is not x_axis and not np.array_equal(line.get_xdata(), x_axis):
+            line.set_data(x_axis, spectrum)
+        else:
+            line.set_ydata(spectrum)
+        ax.set_xlabel("Wavelength (nm)" if wavelength is not None else "Pixel")
+
+        ax.relim()
+        ax.autoscale_view()
+
+    def _render_image(self, fig, data, wavelength):
+        ax = fig.axes[0]
+        img = self.artists.get("image")
+        height, width = data.shape
+        if wavelength is not None:
+            extent = (wavelength[0], wavelength[-1], height - 0.5, -0.5)
+        else:
+            extent = (-0.5, width - 0.5, height - 0.5, -0.5)
+        # the extent is of the full frame, so the axes are the same whatever the reduction
+        data = reduce_image(data, (int(ax.bbox.height), int(ax.bbox.width)))
+
+        if img is None:
+            img = ax.imshow(data, extent=extent, aspect="auto")
+            fig.colorbar(img)
+            self.artists["image"] = img
+        else:
+            if img.get_extent() != list(extent):
+                img.set_extent(extent)
+                ax.set_xlim(extent[0], extent[1])
+                ax.set_ylim(extent[2], extent[3])
+            img.set_data(data)
+            # colour limits follow the data, and the colourbar follows the limits
+            img.set_clim(data.min(), data.max())
+        ax.set_xlabel("Wavelength (nm)" if wavelength is not None else "Pixel")
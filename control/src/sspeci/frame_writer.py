@@ -0,0 +1,180 @@
+import logging
+import os
+import queue
+import threading
+
+import h5py
+import numpy as np
+
+from sspeci.frame_buffer import SETTINGS_DTYPE, SETTINGS_MISSING
+
+
+class FrameWriter:
+    """
+    Writes acquired frames to HDF5 files on a background thread.
+
+    Each file holds a resizable, chunked "data" dataset of shape (frames, height, width), and
+    parallel one dimensional datasets of the frame numbers, timestamps and acquisition settings
+    of every frame. Frames are handed over through a bounded queue: if the disk falls behind
+    and the queue fills up, new frames are dropped (and counted) rather than holding up the
+    acquisition.
+
+    Files are written in SWMR mode and flushed after every write, so they can be read by other
+    processes (opened with swmr=True) while they are still being written. As no datasets can be
+    added to a file in SWMR mode, a change in frame shape or type (e.g. a new binning mode)
+    starts a new file, named after the first with an increasing suffix.
+    """
+
+    def __init__(self, queue_size=100, compression="gzip", compression_level=4, chunk_frames=16):
+        """
+        queue_size: number of writes that can be waiting before frames are dropped
+        compression: "gzip", "lzf", or None for uncompressed files
+        compression_level: gzip compression level, from 0 to 9
+        chunk_frames: number of frames in each chunk of the data dataset
+        """
+        self.compression = compression or None
+        self.compression_level = compression_level if self.compression == "gzip" else None
+        self.chunk_frames = chunk_frames
+
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.path = None
+        self.file_path = None
+        self.frames_written = 0
+        self.frames_dropped = 0
+        self.error = None
+
+        # only used by the writer thread
+        self.file = None
+        self.datasets = {}
+        self.file_count = 0
+
+        self.thread = threading.Thread(target=self._run, name="FrameWriter", daemon=True)
+        self.thread.start()
+
+    @property
+    def is_open(self):
+        return self.path is not None
+
+    def open(self, path):
+        """Start writing frames to a new file, closing any file already open."""
+        self.path = path
+        # the counts are of the frames for this file, and are reset again by the writer thread
+        # once it has finished with any frames still queued for the last one
+        self.frames_written = 0
+        self.frames_dropped = 0
+        self.queue.put(("open", path))
+
+    def close(self):
+        self.path = None
+        self.queue.put(("close", None))
+
+    def stop(self):
+        self.close()
+        self.queue.put(None)
+        self.thread.join()
+
+    def write(self, frames, first_frame_number, timestamp, settings=None):
+        """
+        Queue a stack of consecutive frames to be written to the open file.
+        frames: 3D array of the frames, of shape (frames, height, width). It is not copied,
+        so must not be changed afterwards
+        first_frame_number: sequence number of the first frame in the stack
+        timestamp: time the frames were acquired, either one value or one per frame
+        settings: dict of the acquisition settings the frames were taken with
+        """
+        if not self.is_open:
+            return
+        try:
+            self.queue.put_nowait(("frames", (frames, first_frame_number, timestamp, settings)))
+        except queue.Full:
+            self.frames_dropped += len(frames)
+            logging.warning("HDF5 writer is falling behind, dropped %d frames", len(frames))
+
+    def _run(self):
+        while True:
+            command = self.queue.get()
+            if command is None:
+                break
+            action, args = command
+            try:
+                if action == "open":
+                    self._close_file()
+                    self.file_count = 0
+                    self.file_path = args
+                    self.frames_written = 0
+                elif action == "close":
+                    self._close_file()
+                    self.file_path = None
+                elif self.file_path is not None:
+                    self._write_frames(*args)
+            except (OSError, ValueError, TypeError) as err:
+                logging.error("Error writing frames to %s: %s", self.file_path, err)
+                self.error = str(err)
+        self._close_file()
+
+    def _create_file(self, frames):
+        path = self.file_path
+        if self.file_count:
+            stem, ext = os.path.splitext(path)
+            path = "{}_{:03d}{}".format(stem, self.file_count, ext)
+        self.file_count += 1
+        logging.debug("Writing frames to %s", path)
+
+        self.file = h5py.File(path, "w", libver="latest")
+        frame_shape = frames.shape[1:]
+        self.datasets = {
+            "data": self.file.create_dataset(
+                "data", shape=(0,) + frame_shape, maxshape=(None,) + frame_shape,
+                dtype=frames.dtype, chunks=(self.chunk_frames,) + frame_shape,
+                compression=self.compression, compression_opts=self.compression_level,
+                shuffle=self.compression is not None),
+            "frame_number": self._create_column("frame_number", np.int64),
+            "timestamp": self._create_column("timestamp", np.float64)
+        }
+        for name in SETTINGS_DTYPE.names:
+            dtype = SETTINGS_DTYPE[name]
+            # SWMR can't handle variable length strings, so text is stored as fixed length bytes
+            if dtype.kind == "U":
+                dtype = np.dtype("S{}".format(dtype.itemsize // 4))
+            self.datasets[name] = self._create_column(name, dtype)
+        self.file.swmr_mode = True
+
+    def _create_column(self, name, dtype):
+        return self.file.create_dataset(name, shape=(0,), maxshape=(None,), dtype=dtype,
+                                        chunks=(self.chunk_frames * 64,))
+
+    def _close_file(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            self.datasets = {}
+
+    def _write_frames(self, frames, first_frame_number, timestamp, settings):
+        data = self.datasets.get("data")
+        if data is not None and (data.shape[1:] != frames.shape[1:] or data.dtype != frames.dtype):
+            self._close_file()
+        if self.file is None:
+            self._create_file(frames)
+            data = self.datasets["data"]
+
+        num_frames = len(frames)
+        start = data.shape[0]
+        end = start + num_frames
+        columns = {
+            "data": frames,
+            "frame_number": np.arange(first_frame_number, first_frame_number + num_frames),
+            "timestamp": np.broadcast_to(timestamp, (num_frames,))
+        }
+        for name in SETTINGS_DTYPE.names:
+            value = settings.get(name) if settings else None
+            value = SETTINGS_MISSING[name] if value is None else value
+            if isinstance(value, str):
+                value = value.encode()
+            columns[name] = np.full(num_frames, value, dtype=self.datasets[name].dtype)
+
+        for name, values in columns.items():
+            dataset = self.datasets[name]
+            dataset.resize(end, axis=0)
+            dataset[start:end] = values
+            dataset.flush()
+        self.frames_written += num_frames
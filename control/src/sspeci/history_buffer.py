@@ -0,0 +1,125 @@
+import numpy as np
+
+
+class HistoryBuffer:
+    """
+    Fixed capacity ring buffer of timestamped readings of a set of channels.
+
+    Each reading is a row of a 2D array with a column per channel, and the timestamps are held
+    in an array alongside it. Both are allocated once, and each new reading overwrites the
+    oldest, so the memory used never grows. Channels that weren't read are stored as NaN, and
+    readings with none of the channels asked for are left out of queries.
+
+    Queries over long spans are downsampled to a number of equal time buckets, reporting the
+    minimum, maximum and mean of each channel in each bucket, so a week of readings can be
+    plotted from a few hundred points without losing spikes.
+    """
+
+    def __init__(self, channels, capacity):
+        """
+        channels: names of the channels, in the order of the columns
+        capacity: most readings held
+        """
+        self.channels = tuple(channels)
+        self.capacity = capacity
+        self.timestamps = np.zeros(capacity, dtype=np.float64)
+        self.values = np.full((capacity, len(self.channels)), np.nan, dtype=np.float64)
+        self.count = 0
+        self.head = 0  # index of the slot the next reading will be written to
+
+    def append(self, timestamp, readings):
+        """
+        Add a reading, overwriting the oldest one if the buffer is full.
+        timestamp: time of the reading, in seconds since the epoch
+        readings: dict of the value of each channel read, others are stored as NaN
+        """
+        row = self.values[self.head]
+        row.fill(np.nan)
+        for index, channel in enumerate(self.channels):
+            if channel in readings:
+                row[index] = readings[channel]
+        self.timestamps[self.head] = timestamp
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def _ordered(self, start, end):
+        # slots of the readings from start to end, oldest first. The timestamps are in order
+        # either side of the head, so each side is searched separately
+        first = (self.head - self.count) % self.capacity
+        if first + self.count <= self.capacity:
+            parts = (slice(first, first + self.count),)
+        else:
+            parts = (slice(first, self.capacity), slice(0, self.head))
+        slots = []
+        for part in parts:
+            times = self.timestamps[part]
+            low = np.searchsorted(times, start, side='left')
+            high = np.searchsorted(times, end, side='right')
+            slots.append(np.arange(part.start + low, part.start + high))
+        return np.concatenate(slots)
+
+    def query(self, channels=None, start=None, end=None, max_points=None):
+        """
+        Get the readings of some channels over a span of time.
+        channels: names of the channels to get, defaults to all of them
+        start: earliest time to get, in seconds since the epoch, or counting back from now if
+        negative. Defaults to the oldest reading
+        end: latest time to get, as start. Defaults to the latest reading
+        max_points: if there are more readings than this, they are downsampled to this many
+        equal time buckets, leaving out any empty ones
+        returns: dict of the time of each point and, for each channel, the minimum, maximum
+        and mean of each point. Points that weren't downsampled have the same value for all
+        three. Missing readings are None
+        raises: ValueError if a channel isn't recorded
+        """
+        channels = list(self.channels if channels is None else channels)
+        unknown = set(channels) - set(self.channels)
+        if unknown:
+            raise ValueError("Unknown history channels: {}".format(", ".join(sorted(unknown))))
+        columns = [self.channels.index(channel) for channel in channels]
+
+        now = self.timestamps[(self.head - 1) % self.capacity] if self.count else 0
+        start = -np.inf if start is None else (now + start if start < 0 else start)
+        end = np.inf if end is None else (now + end if end < 0 else end)
+        slots = self._ordered(start, end)
+        times = self.timestamps[slots]
+        values = self.values[np.ix_(slots, columns)]
+        # readings in which none of the channels asked for were read are left out
+        read = ~np.all(np.isnan(values), axis=1)
+        if not np.all(read):
+            times = times[read]
+            values = values[read]
+
+        if max_points and len(times) > max_points:
+            span_start = times[0] if np.isinf(start) else start
+            span_end = times[-1] if np.isinf(end) else end
+            edges = np.linspace(span_start, span_end, max_points + 1)[:-1]
+            # the index of the first reading in each bucket, dropping empty buckets
+            starts = np.unique(np.searchsorted(times, edges, side='left'))
+            starts = starts[starts < len(times)]
+            sizes = np.diff(np.append(starts, len(times)))
+            valid = ~np.isnan(values)
+            counts = np.add.reduceat(valid, starts, axis=0)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                mean = np.add.reduceat(np.where(valid, values, 0), starts, axis=0) / counts
+            low = np.fmin.reduceat(values, starts, axis=0)
+            high = np.fmax.reduceat(values, starts, axis=0)
+            times = np.add.reduceat(times, starts) / sizes
+        else:
+            low = high = mean = values
+
+        return {
+            "time": times.tolist(),
+            "channels": {
+                channel: {
+                    "min": self._to_list(low[:, index]),
+                    "max": self._to_list(high[:, index]),
+                    "mean": self._to_list(mean[:, index])
+                } for index, channel in enumerate(channels)
+            }
+        }
+
+    @staticmethod
+    def _to_list(values):
+        # NaN isn't valid JSON, so missing readings are reported as None
+        return [None if value != value else value for value in values.tolist()]
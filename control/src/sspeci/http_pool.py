@@ -0,0 +1,173 @@
+import asyncio
+import logging
+from collections import namedtuple
+from functools import partial
+
+from tornado import httputil
+from tornado.http1connection import HTTP1Connection, HTTP1ConnectionParameters
+from tornado.httpclient import HTTPClientError
+from tornado.iostream import StreamClosedError
+from tornado.locks import Semaphore
+from tornado.simple_httpclient import HTTPTimeoutError
+from tornado.tcpclient import TCPClient
+
+Response = namedtuple("Response", ("code", "reason", "headers", "body"))
+
+
+class _ResponseReader(httputil.HTTPMessageDelegate):
+    """Collects the response to a request, as it is read from the connection."""
+
+    def __init__(self):
+        self.start_line = None
+        self.headers = None
+        self.chunks = []
+
+    def headers_received(self, start_line, headers):
+        self.start_line = start_line
+        self.headers = headers
+
+    def data_received(self, chunk):
+        self.chunks.append(chunk)
+
+
+class KeepAliveHTTPClient:
+    """
+    Asynchronous HTTP/1.1 client keeping a pool of open connections to one server.
+
+    Tornado's AsyncHTTPClient opens a new connection for every request. This client is built
+    on the same TCPClient and HTTP1Connection, but hands each connection back to the pool
+    once its response has been read, so the next request goes out on it straight away rather
+    than waiting on a new TCP handshake. At most max_connections requests are in flight at
+    once, so the pool never holds more connections than that. Connections the server closes
+    while idle are dropped from the pool, and a request that finds its connection closed
+    under it is retried on a new one, unless it is a POST that may already have taken effect.
+
+    The connections opened and requests sent are counted, so that reuse can be checked: once
+    the pool has warmed up, requests should stop opening new connections.
+    """
+
+    def __init__(self, host, port, max_connections=8, timeout=5):
+        """
+        host: address of the server
+        port: port of the server
+        max_connections: most requests in flight, and connections kept open, at once
+        timeout: default time in seconds to connect, and to wait for each response
+        """
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.tcp_client = TCPClient()
+        self.slots = Semaphore(max_connections)
+        self.idle = []
+        self.default_headers = {
+            'Host': "{}:{}".format(host, port),
+            'Content-Type': 'application/json',
+            'Accept': 'application/json'
+        }
+        self.connections_opened = 0
+        self.requests = 0
+        self.requests_reused = 0
+
+    def stats(self):
+        return {
+            "connections_opened": self.connections_opened,
+            "connections_idle": len(self.idle),
+            "requests": self.requests,
+            "requests_reused": self.requests_reused
+        }
+
+    def close(self):
+        for stream in self.idle:
+            stream.set_close_callback(None)
+            stream.close()
+        self.idle = []
+
+    async def fetch(self, path, method="GET", body=None, timeout=None):
+        """
+        Send a request and wait for the response.
+        path: path of the request, including any query
+        method: HTTP method of the request
+        body: body of the request, as bytes
+        timeout: time in seconds to connect and to wait for the response, defaults to the
+        client's timeout
+        returns: the Response
+        raises: HTTPClientError for an error status or a timeout, OSError if the server can't
+        be reached
+        """
+        timeout = self.timeout if timeout is None else timeout
+        async with self.slots:
+            stream, reused = await self._get_stream(timeout)
+            try:
+                try:
+                    response, keep_alive = await asyncio.wait_for(
+                        self._exchange(stream, method, path, body), timeout)
+                except StreamClosedError:
+                    if not reused or method == "POST":
+                        raise
+                    logging.debug("Connection to %s closed when reused, retrying", self.host)
+                    stream, reused = await self._get_stream(timeout, new=True)
+                    response, keep_alive = await asyncio.wait_for(
+                        self._exchange(stream, method, path, body), timeout)
+            except asyncio.TimeoutError:
+                stream.close()
+                raise HTTPTimeoutError("Timeout waiting for {} {}".format(method, path))
+            except BaseException:
+                stream.close()
+                raise
+
+            self.requests += 1
+            if reused:
+                self.requests_reused += 1
+            if keep_alive:
+                self._release(stream)
+            else:
+                stream.close()
+
+        if response.code >= 400:
+            raise HTTPClientError(response.code, response.reason)
+        return response
+
+    async def _get_stream(self, timeout, new=False):
+        # an idle connection if there is one, otherwise a new one
+        while self.idle and not new:
+            stream = self.idle.pop()
+            stream.set_close_callback(None)
+            if not stream.closed():
+                return stream, True
+        try:
+            stream = await asyncio.wait_for(
+                self.tcp_client.connect(self.host, self.port), timeout)
+        except asyncio.TimeoutError:
+            raise HTTPTimeoutError("Timeout connecting to {}:{}".format(self.host, self.port))
+        stream.set_nodelay(True)
+        self.connections_opened += 1
+        return stream, False
+
+    def _release(self, stream):
+        stream.set_close_callback(partial(self._discard, stream))
+        self.idle.append(stream)
+
+    def _discard(self, stream):
+        if stream in self.idle:
+            self.idle.remove(stream)
+
+    async def _exchange(self, stream, method, path, body):
+        # sends one request on the connection and reads its response, returning it with
+        # whether the connection can be used again
+        connection = HTTP1Connection(stream, True, HTTP1ConnectionParameters())
+        headers = httputil.HTTPHeaders(self.default_headers)
+        if body is not None or method in ("POST", "PUT"):
+            headers['Content-Length'] = str(len(body or b''))
+        connection.write_headers(httputil.RequestStartLine(method, path, 'HTTP/1.1'), headers)
+        if body:
+            connection.write(body)
+        connection.finish()
+
+        reader = _ResponseReader()
+        if not await connection.read_response(reader) or reader.start_line is None:
+            raise StreamClosedError()
+        keep_alive = (not stream.closed() and reader.start_line.version == 'HTTP/1.1' and
+                      reader.headers.get('Connection', '').lower() != 'close')
+        response = Response(reader.start_line.code, reader.start_line.reason, reader.headers,
+                            b''.join(reader.chunks))
+        return response, keep_alive
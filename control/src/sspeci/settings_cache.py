@@ -0,0 +1,68 @@
+import logging
+import time
+
+
+class SettingsCache:
+    """
+    Cache of spectrometer settings, to save a round trip to the bridge for every read.
+
+    Values are written through on set, so reading a setting back after changing it is free.
+    Once the cache is older than its TTL it is revalidated: if the bridge reports the same
+    settings version as before, the cached values are kept, otherwise they are dropped and
+    re-read as they are next needed. Without a version (e.g. from an older bridge) the
+    cache is always dropped when it expires.
+    """
+
+    def __init__(self, ttl, get_version=None):
+        """
+        ttl: time in seconds the cached values are trusted for before being revalidated
+        get_version: coroutine function returning the bridge's settings version, or None if
+        unknown
+        """
+        self.ttl = ttl
+        self.get_version = get_version
+        self.values = {}
+        self.version = None
+        self.validated = time.monotonic()
+
+    async def get(self, name, fetch):
+        """
+        Get a setting, reading it from the bridge if it is not cached.
+        name: name of the setting
+        fetch: coroutine function that reads the setting from the bridge
+        """
+        if time.monotonic() - self.validated > self.ttl:
+            await self.revalidate()
+
+        if name in self.values:
+            return self.values[name]
+
+        value = await fetch()
+        # a failed read comes back as None, and shouldn't be remembered
+        if value is not None:
+            self.values[name] = value
+        return value
+
+    def set(self, name, value):
+        self.values[name] = value
+
+    def update(self, settings):
+        for name, value in settings.items():
+            if value is not None:
+                self.values[name] = value
+
+    def discard(self, name):
+        self.values.pop(name, None)
+
+    def invalidate(self):
+        self.values.clear()
+        self.version = None
+        self.validated = time.monotonic()
+
+    async def revalidate(self):
+        version = await self.get_version() if self.get_version else None
+        if version is None or version != self.version:
+            logging.debug("Settings cache expired (version %s -> %s)", self.version, version)
+            self.values.clear()
+        self.version = version
+        self.validated = time.monotonic()
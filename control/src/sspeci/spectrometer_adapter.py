@@ -1,91 +1,317 @@
+import asyncio
 import logging
 import re
 import io
 import sys
 import os
 import json
+import time
+import hashlib
+from collections import OrderedDict, deque
+from functools import partial
 from tempfile import TemporaryFile
 from gevent.timeout import Timeout
 
-import zerorpc
-from zerorpc.exceptions import (LostRemote, TimeoutExpired)
+from zerorpc.exceptions import (LostRemote, TimeoutExpired, RemoteError)
 
 from odin_data.ipc_channel import IpcChannel, IpcChannelException
 from odin_data.ipc_message import IpcMessage, IpcMessageException
 
-from odin.adapters.adapter import (ApiAdapter, ApiAdapterRequest,
-                                   ApiAdapterResponse, request_types, response_types)
-from odin.adapters.parameter_tree import ParameterTree, ParameterTreeError
+from odin.adapters.adapter import (ApiAdapterRequest, ApiAdapterResponse,
+                                   request_types, response_types)
+from odin.adapters.async_adapter import AsyncApiAdapter
+from odin.adapters.async_parameter_tree import AsyncParameterTree
+from odin.adapters.parameter_tree import ParameterTreeError
 from odin.util import decode_request_body
 
 from tornado.ioloop import PeriodicCallback, IOLoop
 from tornado.concurrent import run_on_executor
 from concurrent import futures
 
-logging.getLogger('matplotlib').setLevel(logging.WARNING)
-
 import numpy as np
-import matplotlib
-matplotlib.use('TkAgg')
-import matplotlib.pyplot as plt
 
+from sspeci.acquisition_job import AcquisitionJob
+from sspeci.async_zerorpc import AsyncZeroRPCClient
+from sspeci.frame_codec import (decode_frames, encode_frames, encode_accumulation,
+                                FRAME_CONTENT_TYPES)
+from sspeci.frame_renderer import FrameRenderer
+from sspeci.frame_decimate import decimate_line, reduce_image
+from sspeci.frame_image import FrameImageEncoder, IMAGE_CONTENT_TYPES
+from sspeci.frame_buffer import FrameBuffer, FrameBufferError
+from sspeci.frame_push import FramePublisher
+from sspeci.frame_writer import FrameWriter
+from sspeci.frame_correction import FrameCorrector
+from sspeci.frame_accumulator import FrameAccumulator
+from sspeci.frame_peaks import PeakFitter, PEAK_PROFILES
+from sspeci.settings_cache import SettingsCache
+
+
+class SpectrometerAdapter(AsyncApiAdapter):
 
-class SpectrometerAdapter(ApiAdapter):
+    # parameter tree branches holding spectrometer settings, and the settings in them
+    SETTINGS_TREE = {
+        "binning": ("binning_mode", "row_bin_centre", "bin_width", "bin_height"),
+        "acquisition": ("exposure", "centre_wavelength")
+    }
 
+    # settings the wavelength calibration of a frame depends on
+    CALIBRATION_SETTINGS = ("grating", "centre_wavelength", "binning_mode", "bin_width")
+
+    # decoding and rendering run on separate workers, so the next frame can be
+    # decoded while the previous one is still being drawn
     executor = futures.ThreadPoolExecutor(max_workers=1)
+    render_executor = futures.ThreadPoolExecutor(max_workers=1)
+    # peak fitting has its own worker, so it doesn't hold up decoding either
+    analysis_executor = futures.ThreadPoolExecutor(max_workers=1)
 
     def __init__(self, **kwargs):
         super(SpectrometerAdapter, self).__init__(**kwargs)
 
         self.endpoint = self.options.get("endpoint", "tcp://127.0.0.1:4242")
+        # long exposures can take far longer than the default zerorpc timeout
+        self.acquire_timeout = float(self.options.get("acquire_timeout", 300))
+        buffer_frames = int(self.options.get("buffer_frames", 100))
+        # largest number of frames captured and sent back by the bridge in one go
+        self.max_burst_frames = int(self.options.get("max_burst_frames", 100))
+        # port for the WebSocket server pushing new frames to clients, 0 to disable it
+        self.push_port = int(self.options.get("push_port", 8889))
+        push_addr = self.options.get("push_addr", "127.0.0.1")
+        # how long cached settings are trusted before checking with the bridge for changes
+        settings_ttl = float(self.options.get("settings_ttl", 5))
+        # frames the bridge holds for a preview that is falling behind, before dropping the oldest
+        self.stream_queue_frames = int(self.options.get("stream_queue_frames", 4))
+        # directory HDF5 files are written to, the file names are given through the API
+        self.data_dir = self.options.get("data_dir", ".")
+        write_compression = self.options.get("write_compression", "gzip")
+        if write_compression == "none":
+            write_compression = None
+        write_queue = int(self.options.get("write_queue", 100))
 
         # try:
-        self.client = zerorpc.Client(heartbeat=20)
+        # calls are awaited on the event loop, so a slow call to the bridge doesn't hold up
+        # requests to other adapters
+        self.client = AsyncZeroRPCClient()
         # self.client.debug = True
         self.client.connect(self.endpoint)
 
         # self.set_start_lightfield(True)
 
-        self.param_tree = ParameterTree({
+        self.acquiring = False
+        self.frames_remaining = 0
+        self.render_pending = None
+        self.rendering = False
+        self.acquire_task = None
+        self.previewing = False
+        self.frames_dropped = 0
+
+        self.frame_buffer = FrameBuffer(buffer_frames)
+        self.frame_number = 0
+        self.run_settings = None
+        # encoded copies of recently requested frames, keyed by frame number and content type
+        self.encoded_frames = OrderedDict()
+        self.encoded_frames_size = 16
+
+        # wavelength axes for recently used settings, keyed by the CALIBRATION_SETTINGS values
+        # and frame width, so going back to earlier settings doesn't need the bridge
+        self.calibration_axes = OrderedDict()
+        self.calibration_axes_size = 8
+        self.calibration_key = None
+        self.calibration = None
+
+        self.corrector = FrameCorrector(float(self.options.get("dark_temperature_step", 1.0)))
+
+        self.accumulator = FrameAccumulator(int(self.options.get("accumulate_frames", 0)))
+        self.accumulated_wavelength = None
+        # rendered accumulation images, keyed by quantity, with the frame count they show
+        self.accumulated_images = {}
+
+        self.peak_fitter = PeakFitter(self.options.get("peak_profile", "gaussian"),
+                                      int(self.options.get("peak_max", 8)),
+                                      float(self.options.get("peak_threshold", 5.0)),
+                                      int(self.options.get("peak_window", 15)))
+        self.peaks = self.peak_fitter.result()
+        self.peak_frame_number = None
+        self.peak_frames_fitted = 0
+        self.peak_frames_skipped = 0
+        self.peak_fit_time = None
+        self.analysing = False
+        self.analysis_pending = None
+
+        # acquisition jobs waiting to run, the one running, and the last few to finish
+        self.jobs = deque()
+        self.job = None
+        self.job_task = None
+        self.job_count = 0
+        self.finished_jobs = deque(maxlen=int(self.options.get("job_history", 8)))
+
+        self.renderer = FrameRenderer()
+        # decimated plots of the latest frame at the sizes clients have asked for, keyed by
+        # frame number and size
+        self.preview_images = OrderedDict()
+        self.preview_images_size = 8
+        self.image_encoder = FrameImageEncoder(self.options.get("image_colormap", "viridis"))
+        # encoded images of the latest frame, keyed by frame number, type and size
+        self.frame_images = OrderedDict()
+        self.frame_images_size = 8
+        self.rendered_graph = None
+        self.rendered_frame_number = None
+        self.rendered_etag = None
+
+        self.publisher = FramePublisher(self.push_port, push_addr) if self.push_port else None
+
+        self.writer = FrameWriter(write_queue, write_compression)
+
+        self.settings_cache = SettingsCache(settings_ttl, self.get_settings_version)
+        # cleared if the bridge is too old to read and write settings in batches
+        self.bulk_settings = True
+
+        self.param_tree = AsyncParameterTree({
             "start_lightfield": (None, self.set_start_lightfield),
             "get_data": (None, self.get_data),
+            "acquiring": (lambda: self.acquiring, None),
+            "preview": (lambda: self.previewing, self.set_preview),
+            "frames_dropped": (lambda: self.frames_dropped, None),
+            "push_port": (self.push_port, None),
+            "image_frame": (lambda: self.rendered_frame_number, None),
+            "image_etag": (lambda: self.rendered_etag, None),
+            "writer":
+                {
+                    "file": (lambda: self.writer.path or "", self.set_write_file),
+                    "frames_written": (lambda: self.writer.frames_written, None),
+                    "frames_dropped": (lambda: self.writer.frames_dropped, None),
+                    "error": (lambda: self.writer.error or "", None)
+                },
+            "correction":
+                {
+                    "enabled": (lambda: self.corrector.enabled, self.set_correction_enabled),
+                    "flat_enabled": (lambda: self.corrector.flat_enabled, self.set_flat_enabled),
+                    "acquire_dark": (None, partial(self.acquire_reference, "dark")),
+                    "acquire_flat": (None, partial(self.acquire_reference, "flat")),
+                    "darks": (lambda: self.corrector.describe()["darks"], None),
+                    "flats": (lambda: self.corrector.describe()["flats"], None),
+                    "clear": (None, self.corrector.clear)
+                },
+            "accumulation":
+                {
+                    "enabled": (lambda: self.accumulator.enabled, self.set_accumulation_enabled),
+                    "target_frames": (lambda: self.accumulator.target_frames,
+                                      self.set_accumulation_target),
+                    "frames": (lambda: self.accumulator.count, None),
+                    "complete": (lambda: self.accumulator.complete, None),
+                    "reset": (None, self.reset_accumulation)
+                },
+            "peaks":
+                {
+                    "enabled": (lambda: self.peak_fitter.enabled, self.set_peaks_enabled),
+                    "profile": (lambda: self.peak_fitter.profile,
+                                partial(self.set_peak_option, "profile"),
+                                {"allowed_values": list(PEAK_PROFILES)}),
+                    "max_peaks": (lambda: self.peak_fitter.max_peaks,
+                                  partial(self.set_peak_option, "max_peaks"), {"min": 1}),
+                    "threshold": (lambda: self.peak_fitter.threshold,
+                                  partial(self.set_peak_option, "threshold"), {"min": 0}),
+                    "window": (lambda: self.peak_fitter.window,
+                               partial(self.set_peak_option, "window"), {"min": 2}),
+                    "frame_number": (lambda: self.peak_frame_number, None),
+                    "frames_fitted": (lambda: self.peak_frames_fitted, None),
+                    "frames_skipped": (lambda: self.peak_frames_skipped, None),
+                    "fit_time": (lambda: self.peak_fit_time, None),
+                    "count": (lambda: self.peaks["count"], None),
+                    "centre": (lambda: self.peaks["centre"], None),
+                    "width": (lambda: self.peaks["width"], None),
+                    "amplitude": (lambda: self.peaks["amplitude"], None),
+                    "offset": (lambda: self.peaks["offset"], None),
+                    "eta": (lambda: self.peaks["eta"], None),
+                    "residual": (lambda: self.peaks["residual"], None),
+                    "reset": (None, self.reset_peaks)
+                },
+            "jobs":
+                {
+                    "submit": (None, self.submit_job),
+                    "cancel": (None, self.cancel_job),
+                    "clear": (None, self.clear_jobs),
+                    "current": (lambda: self.job.describe() if self.job else None, None),
+                    "queued": (lambda: [job.describe() for job in self.jobs], None),
+                    "finished": (lambda: [job.describe() for job in self.finished_jobs], None)
+                },
+            "buffer":
+                {
+                    "capacity": (self.frame_buffer.capacity, None),
+                    "frames_stored": (lambda: self.frame_buffer.count, None),
+                    "first_frame": (lambda: self.frame_buffer.first_frame_number, None),
+                    "latest_frame": (lambda: self.frame_buffer.latest_frame_number, None)
+                },
             "binning":
                 {
-                    "binning_mode": (self.get_binning_mode, self.set_binning_mode),
-                    "row_bin_centre": (self.get_row_bin_centre, self.set_row_bin_centre),
-                    "bin_width": (self.get_bin_width, self.set_bin_width),
-                    "bin_height": (self.get_bin_height, self.set_bin_height)
+                    "binning_mode": self.cached_param(
+                        "binning_mode", self.get_binning_mode, self.set_binning_mode),
+                    "row_bin_centre": self.cached_param(
+                        "row_bin_centre", self.get_row_bin_centre, self.set_row_bin_centre),
+                    "bin_width": self.cached_param(
+                        "bin_width", self.get_bin_width, self.set_bin_width),
+                    "bin_height": self.cached_param(
+                        "bin_height", self.get_bin_height, self.set_bin_height)
                 },
             "acquisition":
             {
-                "exposure": (self.get_exposure, self.set_exposure),
-                "centre_wavelength": (self.get_centre_wavelength, self.set_centre_wavelength)
+                "exposure": self.cached_param(
+                    "exposure", self.get_exposure, self.set_exposure),
+                "centre_wavelength": self.cached_param(
+                    "centre_wavelength", self.get_centre_wavelength, self.set_centre_wavelength)
             }
         })
-        # except (LostRemote, TimeoutExpired) as remote_err:
-            # logging.error("Unable to connect to Server: %s", remote_err)
-        self.rendered_graph = None
+        # cleared if the bridge is too old to send frames in the binary format
+        self.binary_frames = True
         logging.getLogger("zerorpc.channel").setLevel(logging.WARNING)
 
-
-
-
-    @response_types('application/json', 'image/*', 'image/webp', default='application/json')
-    def get(self, path, request):
+    @response_types('application/json', 'application/octet-stream', 'application/x-npy',
+                    'image/*', 'image/png', 'image/webp', 'image/jpeg', default='application/json')
+    async def get(self, path, request):
         try:
             path_elems = re.split('[/?#]', path)
-            if path_elems[0] == 'image':
-                #return plot image
+            if path_elems[0] == 'image' and path_elems[1:2] == ['preview']:
+                response = await self.get_preview_image(*self.get_preview_size(request))
+                content_type = 'image/png'
+                status = 200
+            elif path_elems[0] == 'image' and path_elems[1:2] == ['frame']:
+                content_type = self.negotiate_content_type(request, IMAGE_CONTENT_TYPES)
+                size = self.get_preview_size(request, (4096, 4096))
+                response = await self.get_frame_image(content_type, *size)
+                status = 200
+            elif path_elems[0] == 'image' and len(path_elems) > 1 and path_elems[1]:
+                response = await self.get_accumulated_image(path_elems[1])
+                content_type = 'image/png'
+                status = 200
+            elif path_elems[0] == 'image':
+                # return plot image
+                # The same bytes object is returned until the next render. Its ETag is the
+                # SHA1 of the image, which is what tornado computes for GET responses, so a
+                # request with a matching If-None-Match gets a 304 with no body.
                 if self.rendered_graph:
-                    response = self.rendered_graph.getvalue()
+                    response = self.rendered_graph
                     content_type = 'image/png'
                     status = 200
                 else:
                     response = {"response": "SpectrometerAdapter: No Graph Available"}
                     content_type = 'application/json'
                     status = 400
+            elif path_elems[0] == 'data' and path_elems[1:2] == ['accumulated']:
+                content_type = self.negotiate_content_type(request, FRAME_CONTENT_TYPES)
+                result = await self.get_accumulation_result()
+                response = encode_accumulation(result, content_type, self.accumulated_wavelength)
+                status = 200
+            elif path_elems[0] == 'data' and path_elems[1:2] == ['preview']:
+                response = self.get_preview_data(*self.get_preview_size(request))
+                content_type = 'application/json'
+                status = 200
+            elif path_elems[0] == 'data':
+                content_type = self.negotiate_content_type(request, FRAME_CONTENT_TYPES)
+                response = self.get_buffered_frames(path_elems[1:], content_type)
+                if isinstance(response, dict):
+                    content_type = 'application/json'
+                status = 200
             else:
-                response = self.param_tree.get(path)
+                response = await self.param_tree.get(path)
                 content_type = 'application/json'
                 status = 200
         except ParameterTreeError as param_error:
@@ -96,16 +322,22 @@ class SpectrometerAdapter(ApiAdapter):
             response = {'response': "ZeroRPC REMOTE GET Error: {}".format(remote_err)}
             content_type = "application/json"
             status = 400
-    
+        except (FrameBufferError, ValueError) as buffer_err:
+            response = {'response': "Frame buffer GET Error: {}".format(buffer_err)}
+            content_type = "application/json"
+            status = 400
+
         return ApiAdapterResponse(response, content_type=content_type, status_code=status)
 
     @response_types('application/json', default='application/json')
-    def put(self, path, request):
+    async def put(self, path, request):
         try:
             data = decode_request_body(request)
-            self.param_tree.set(path, data)
+            settings = self.collect_settings(path, data)
+            if not (settings and await self.apply_settings(settings)):
+                await self.param_tree.set(path, data)
 
-            response = self.param_tree.get(path)
+            response = await self.param_tree.get(path)
             content_type = 'application/json'
             status = 200
 
@@ -120,134 +352,962 @@ class SpectrometerAdapter(ApiAdapter):
 
         return ApiAdapterResponse(response, content_type=content_type, status_code=status)
 
-    def get_device_found(self):
+    def negotiate_content_type(self, request, content_types):
+        """
+        Pick the response type for a request from its Accept header.
+        content_types: the types that can be returned, the first is the default
+        returns: the first type in the Accept header that can be returned, or the default
+        """
+        for accept_type in request.headers.get('Accept', '').split(','):
+            accept_type = accept_type.split(';')[0].strip()
+            if accept_type in content_types:
+                return accept_type
+        return content_types[0]
+
+    def get_preview_size(self, request, default_size=None):
+        """
+        Get the preview size asked for by the width and height query arguments of a request.
+        default_size: (width, height) if not given, defaults to the size of the pushed images
+        returns: (width, height) in pixels
+        """
+        size = []
+        for name, default in zip(("width", "height"), default_size or self.renderer.size):
+            try:
+                value = int(request.query_arguments.get(name, [default])[0])
+            except ValueError:
+                raise ValueError("Preview {} must be an integer".format(name))
+            size.append(min(max(value, 16), 4096))
+        return tuple(size)
+
+    def get_preview_frame(self):
+        # the latest frame, corrected if it was, as it is shown in the pushed images
+        frame = self.frame_buffer.latest()
+        return self.frame_variant(frame, frame["corrected"] is not None)
+
+    async def get_preview_image(self, width, height):
+        """
+        Get a plot of the latest frame at the given size, decimated to the size of the plot.
+        Each frame is only rendered once per size.
+        returns: the PNG encoded image
+        """
+        frame = self.get_preview_frame()
+        key = (frame["frame_number"], frame["corrected"], width, height)
+        if key in self.preview_images:
+            self.preview_images.move_to_end(key)
+        else:
+            # copied, as the buffer slot could be reused before the render is finished
+            image, etag = await self.render_graph(frame["data"].copy(), frame["wavelength"],
+                                                  (width, height))
+            self.preview_images[key] = image
+            if len(self.preview_images) > self.preview_images_size:
+                self.preview_images.popitem(last=False)
+        return self.preview_images[key]
+
+    async def get_frame_image(self, content_type, width, height):
+        """
+        Get the latest frame as a false colour image with no annotations, made without
+        matplotlib. Frames larger than width x height are block averaged to fit. Each frame is
+        only encoded once per type and size.
+        content_type: type of image, one of IMAGE_CONTENT_TYPES
+        returns: the encoded image
+        """
+        frame = self.get_preview_frame()
+        key = (frame["frame_number"], frame["corrected"], content_type, width, height)
+        if key in self.frame_images:
+            self.frame_images.move_to_end(key)
+        else:
+            self.frame_images[key] = await self.encode_frame_image(
+                frame["data"].copy(), content_type, (height, width))
+            if len(self.frame_images) > self.frame_images_size:
+                self.frame_images.popitem(last=False)
+        return self.frame_images[key]
+
+    def get_preview_data(self, width, height):
+        """
+        Get the latest frame decimated for display at the given size, for clients that plot
+        the data themselves. Line spectra keep the minimum and maximum of each of width bins,
+        and images are averaged over blocks to fit in width x height. The full resolution
+        frame is still available from data/latest.
+        returns: dict of the frame metadata, the x axis (the wavelength, or pixel, of each
+        point or column) and the decimated data
+        """
+        frame = self.get_preview_frame()
+        data = frame["data"]
+        x_axis = frame["wavelength"]
+        if x_axis is None:
+            x_axis = np.arange(data.shape[-1], dtype=np.float64)
+        if data.shape[0] == 1:
+            x_axis, preview = decimate_line(data[0], x_axis, 2 * width)
+            preview = preview[np.newaxis]
+        else:
+            preview = reduce_image(data, (height, width))
+            x_axis = reduce_image(x_axis[np.newaxis], (1, preview.shape[1]))[0]
+        return {
+            "frame_number": frame["frame_number"],
+            "timestamp": frame["timestamp"],
+            "corrected": frame["corrected"],
+            "shape": list(data.shape),
+            "wavelength": frame["wavelength"] is not None,
+            "x": x_axis.tolist(),
+            "data": preview.tolist()
+        }
+
+    def get_buffered_frames(self, selector, content_type='application/json'):
+        """
+        Get frames from the frame buffer.
+        selector: remaining path elements after 'data'. Either empty (buffer summary),
+        'latest', a frame number, or a 'start:stop' range of frame numbers, optionally
+        followed by 'raw' (the default) or 'corrected' for the dark corrected frames
+        content_type: type to encode the frame(s) as, one of FRAME_CONTENT_TYPES
+        returns: the encoded frame(s), or a dict of the buffer summary
+        """
+        variant = selector[1] if len(selector) > 1 and selector[1] else 'raw'
+        if variant not in ('raw', 'corrected'):
+            raise ValueError("Unknown frame type {}, expected raw or corrected".format(variant))
+        corrected = variant == 'corrected'
+        selector = selector[0] if selector else ''
+        if selector == '':
+            return {
+                "capacity": self.frame_buffer.capacity,
+                "frames_stored": self.frame_buffer.count,
+                "first_frame": self.frame_buffer.first_frame_number,
+                "latest_frame": self.frame_buffer.latest_frame_number
+            }
+        if ':' in selector:
+            start, stop = [int(x) if x else None for x in selector.split(':', 1)]
+            frames = self.frame_buffer.get_slice(start, stop)
+            return encode_frames([self.frame_variant(frame, corrected) for frame in frames],
+                                 content_type)
+        if selector == 'latest':
+            frame = self.frame_buffer.latest()
+        else:
+            frame = self.frame_buffer.get(int(selector))
+        return self.get_encoded_frame(self.frame_variant(frame, corrected), content_type)
+
+    def frame_variant(self, frame, corrected):
+        # the record is given either its raw or its corrected data, with a flag saying which
+        if corrected and frame["corrected"] is None:
+            raise FrameBufferError("Frame {} has not been corrected".format(frame["frame_number"]))
+        data = frame["corrected"] if corrected else frame["data"]
+        return dict(frame, data=data, corrected=corrected)
+
+    def get_encoded_frame(self, frame, content_type):
+        # frames don't change once acquired, so each one is only encoded once per type
+        # no matter how many clients ask for it
+        key = (frame["frame_number"], frame["corrected"], content_type)
+        if key in self.encoded_frames:
+            self.encoded_frames.move_to_end(key)
+        else:
+            self.encoded_frames[key] = encode_frames(frame, content_type)
+            if len(self.encoded_frames) > self.encoded_frames_size:
+                self.encoded_frames.popitem(last=False)
+        return self.encoded_frames[key]
+
+    async def cleanup(self):
+        if self.acquire_task:
+            self.acquire_task.cancel()
+        if self.job_task:
+            self.job_task.cancel()
+        if self.publisher:
+            self.publisher.stop()
+        self.writer.stop()
+        self.client.close()
+
+    def set_write_file(self, name):
+        """
+        Start writing acquired frames to a new HDF5 file, or stop writing them.
+        name: name of the file in the data directory, or an empty string to stop writing
+        """
+        if name:
+            self.writer.open(os.path.join(self.data_dir, name))
+        else:
+            self.writer.close()
+
+    def cached_param(self, name, getter, setter):
+        """
+        Build a parameter tree accessor for a spectrometer setting that goes through the
+        settings cache.
+        name: name of the setting in the cache
+        getter: method reading the setting from the bridge
+        setter: method writing the setting to the bridge
+        """
+        async def set_and_cache(value):
+            await setter(value)
+            self.settings_cache.set(name, value)
+            if name in self.CALIBRATION_SETTINGS:
+                self.calibration_key = None
+
+        return (lambda: self.settings_cache.get(name, partial(self.read_setting, name, getter)),
+                set_and_cache)
 
+    async def read_setting(self, name, getter):
+        # on a cache miss every setting is read in one go, as the rest are likely to be
+        # wanted too, falling back to the single getter for older bridges
         try:
-            return self.client.device_found()
+            values = await self.fetch_settings()
+        except (LostRemote, TimeoutExpired) as remote_err:
+            logging.error("Remote Error trying to read settings: %s", remote_err)
+            return None
+        if values is None:
+            return await getter()
+        self.settings_cache.update(values)
+        return values.get(name)
+
+    async def fetch_settings(self):
+        """
+        Read all the spectrometer settings with a single RPC.
+        returns: dict of the settings, or None if the bridge can't read settings in batches
+        """
+        if not self.bulk_settings:
+            return None
+        try:
+            result = await self.client.get_settings()
+        except RemoteError as remote_err:
+            if remote_err.name != "NameError":
+                raise
+            logging.warning("Bridge does not support batched settings, reading them one by one")
+            self.bulk_settings = False
+            return None
+        for name, error in result["errors"].items():
+            logging.error("Error reading setting %s: %s", name, error)
+        return result["values"]
+
+    def collect_settings(self, path, data):
+        """
+        Check whether the data PUT to a path only holds spectrometer settings.
+        returns: dict of setting: value if so, otherwise None
+        """
+        path = path.strip('/')
+        for elem in reversed(path.split('/') if path else []):
+            data = {elem: data}
+        if not isinstance(data, dict):
+            return None
+
+        settings = {}
+        for branch, values in data.items():
+            if branch not in self.SETTINGS_TREE or not isinstance(values, dict):
+                return None
+            for name, value in values.items():
+                if name not in self.SETTINGS_TREE[branch]:
+                    return None
+                settings[name] = value
+        return settings
+
+    async def apply_settings(self, settings):
+        """
+        Write a batch of spectrometer settings with a single RPC, updating the cache.
+        returns: False if the bridge can't write settings in batches, True otherwise
+        """
+        if not self.bulk_settings:
+            return False
+        try:
+            result = await self.client.apply_settings(settings)
+        except RemoteError as remote_err:
+            if remote_err.name != "NameError":
+                raise
+            logging.warning("Bridge does not support batched settings, writing them one by one")
+            self.bulk_settings = False
+            return False
+
+        for name in result["applied"]:
+            self.settings_cache.set(name, settings[name])
+            if name in self.CALIBRATION_SETTINGS:
+                self.calibration_key = None
+        for name, error in result["errors"].items():
+            logging.error("Error setting %s: %s", name, error)
+            self.settings_cache.discard(name)
+        return True
+
+    async def get_settings_version(self):
+        try:
+            return await self.client.get_settings_version()
+        except RemoteError as remote_err:
+            if remote_err.name != "NameError":
+                logging.error("Remote Error trying to get settings version: %s", remote_err)
+        except (LostRemote, TimeoutExpired) as remote_err:
+            logging.error("Remote Error trying to get settings version: %s", remote_err)
+        return None
+
+    async def get_device_found(self):
+
+        try:
+            return await self.client.device_found()
         except (LostRemote, TimeoutExpired) as remote_err:
             logging.error("Remote error in get_device_found: %s", remote_err)
             return False
 
-    def set_start_lightfield(self, value):
-        
+    async def set_start_lightfield(self, value):
+
         try:
-            self.client.start_lightfield(value)
+            await self.client.start_lightfield(value)
         except (LostRemote, TimeoutExpired) as remote_err:
             logging.error("Remote Error in set_start_lightfield: %s", remote_err)
 
-    def is_lightfield_running(self):
+    async def is_lightfield_running(self):
 
         try:
-            return self.client.is_lightfield_started()
+            return await self.client.is_lightfield_started()
         except (LostRemote, TimeoutExpired) as remote_err:
             logging.error("Remote Error trying to get Lightfield status: %s", remote_err)
 
     def get_data(self, frames=1):
-        IOLoop.current().add_callback(self.get_frame_from_spectrometer, frames)
+        if self.acquiring:
+            logging.warning("Acquisition already in progress, ignoring request for %d frames",
+                            frames)
+            return
+        self.acquiring = True
+        self.frames_remaining = max(frames, 1)
+        self.run_settings = None
+        # the settings are re-read at the start of every run, and those values are cached
+        self.settings_cache.invalidate()
+        self.acquire_task = asyncio.ensure_future(self.acquire_frames())
+
+    # The acquisition pipeline. Frames are captured by awaiting the bridge on the event loop,
+    # decoded on the executor and drawn on the render executor, so the loop is never blocked by
+    # an exposure or a render and other requests are served while a run is in progress. Frames
+    # are captured in bursts of up to max_burst_frames, each returned by the bridge in one RPC.
 
-    def get_frame_from_spectrometer(self, frames):
-        logging.debug("Getting Frame : %d", frames)
+    async def acquire_frames(self):
         try:
-            frame_data = self.client.start_acquire(1)
-            data = np.array(frame_data['data'])
-            data = data.reshape([frame_data['height'], frame_data['width']])
-            logging.debug("Data shape: %s", data.shape)
-            logging.debug("Data Type: %s", data.dtype)
-            # plt.plot(data)
+            # settings can't change mid-run, so they are only read before the first frame
+            self.run_settings = await self.read_acquisition_settings()
+            async for frames, timestamp in self.capture_frames(self.frames_remaining):
+                self.frames_remaining -= len(frames)
+                await self.frames_acquired(frames, timestamp)
+        except (LostRemote, TimeoutExpired) as remote_err:
+            logging.error("Remote Error in get_data: %s", remote_err)
+        except asyncio.CancelledError:
+            raise
+        except Exception as err:
+            logging.error("Error acquiring frame: %s", err)
+        finally:
+            self.frames_remaining = 0
+            self.acquiring = False
+
+    async def capture_frames(self, num_frames):
+        # yields each burst of frames captured, decoded, with the time it was captured
+        remaining = num_frames
+        while remaining > 0:
+            logging.debug("Getting Frames, %d remaining", remaining)
+            burst = min(remaining, self.max_burst_frames) if self.binary_frames else 1
+            frame_data = await self.acquire_frame_data(burst)
+            timestamp = time.time()
+            if frame_data is None:
+                logging.warning("No frame returned, is the experiment ready to run?")
+                return
+            frames = await self.decode_frame_data(frame_data)
+            remaining -= len(frames)
+            yield frames, timestamp
+
+    def submit_job(self, steps):
+        """
+        Queue a job of acquisition steps, to be run once those before it have finished.
+        steps: list of steps, as described by AcquisitionJob
+        """
+        setting_names = [name for names in self.SETTINGS_TREE.values() for name in names]
+        try:
+            job = AcquisitionJob(self.job_count + 1, steps, setting_names)
+        except ValueError as err:
+            raise ParameterTreeError(str(err))
+        self.job_count += 1
+        self.jobs.append(job)
+        if self.job_task is None:
+            self.job_task = asyncio.ensure_future(self.run_jobs())
+
+    def cancel_job(self, job_id):
+        """
+        Cancel a queued job, or stop the running one once its current burst of frames is in.
+        job_id: id of the job to cancel
+        """
+        if self.job is not None and self.job.job_id == job_id:
+            self.job.cancelled = True
+            return
+        for job in self.jobs:
+            if job.job_id == job_id:
+                self.jobs.remove(job)
+                job.status = "cancelled"
+                self.finished_jobs.append(job)
+                return
+        raise ParameterTreeError("No queued or running job {}".format(job_id))
+
+    def clear_jobs(self, value=None):
+        while self.jobs:
+            self.cancel_job(self.jobs[0].job_id)
 
-            fig, ax1 = plt.subplots()
+    async def run_jobs(self):
+        try:
+            while self.jobs:
+                # a job waits for any acquisition started by hand to finish
+                while self.acquiring:
+                    await asyncio.sleep(0.1)
+                if not self.jobs:
+                    break
+                self.job = self.jobs.popleft()
+                await self.run_job(self.job)
+                self.finished_jobs.append(self.job)
+                self.job = None
+        finally:
+            self.job_task = None
+
+    async def run_job(self, job):
+        # the job holds the acquisition for its whole run, so nothing else can start between
+        # its steps
+        logging.debug("Running job %d of %d steps", job.job_id, len(job.steps))
+        self.acquiring = True
+        job.status = "running"
+        job.started = time.time()
+        # the bridge's settings are unknown at the start, so the first step writes all of its
+        # settings, and each one after only those that differ from the step before
+        previous = {}
+        self.settings_cache.invalidate()
+        try:
+            for index, step in enumerate(job.steps):
+                if job.cancelled:
+                    break
+                job.current_step = index
+                job.results.append(await self.run_step(job, step, previous))
+                previous.update(step["settings"])
+            job.status = "cancelled" if job.cancelled else "complete"
+        except (LostRemote, TimeoutExpired, RemoteError) as remote_err:
+            logging.error("Remote Error in job %d: %s", job.job_id, remote_err)
+            job.status = "failed"
+            job.error = str(remote_err)
+        except ParameterTreeError as param_error:
+            logging.error("Error applying settings in job %d: %s", job.job_id, param_error)
+            job.status = "failed"
+            job.error = str(param_error)
+        except asyncio.CancelledError:
+            job.status = "cancelled"
+            raise
+        except Exception as err:
+            logging.error("Error running job %d: %s", job.job_id, err)
+            job.status = "failed"
+            job.error = str(err)
+        finally:
+            self.acquiring = False
+            job.current_step = None
+            job.finished = time.time()
+
+    async def run_step(self, job, step, previous):
+        """
+        Run one step of a job.
+        returns: dict of the result of the step
+        """
+        changed = {name: value for name, value in step["settings"].items()
+                   if name not in previous or previous[name] != value}
+        if changed:
+            await self.write_settings(changed)
+
+        options = step["options"]
+        if "correct" in options:
+            self.corrector.enabled = bool(options["correct"])
+        if "peaks" in options:
+            self.peak_fitter.enabled = bool(options["peaks"])
+        if "accumulate" in options:
+            if options["accumulate"]:
+                self.reset_accumulation()
+            self.accumulator.enabled = bool(options["accumulate"])
+        # a file the user already has open is written to as it is, and left open at the end
+        # of the step, so only a file the step opened itself is closed
+        file_name = options.get("file")
+        opened_path = None
+        if file_name:
+            path = os.path.join(self.data_dir, file_name)
+            if self.writer.path != path:
+                self.writer.open(path)
+                opened_path = path
+
+        result = {"settings": changed, "first_frame": self.frame_number + 1, "frames": 0}
+        start = time.time()
+        try:
+            self.run_settings = await self.read_acquisition_settings()
+            async for frames, timestamp in self.capture_frames(step["frames"]):
+                await self.frames_acquired(frames, timestamp)
+                result["frames"] += len(frames)
+                job.frames_acquired += len(frames)
+                if job.cancelled:
+                    break
+        finally:
+            if opened_path is not None and self.writer.path == opened_path:
+                self.writer.close()
+        result["duration"] = time.time() - start
 
-            ax1.set_title("Science!")
-            if frame_data['height'] == 1:
-                ax1.plot(data.reshape(-1))
-                ax1.set_xlabel("Wavelength (nm)")
-                ax1.set_ylabel("Intensity (Counts)")
+        if file_name:
+            result["file"] = file_name
+        if options.get("accumulate"):
+            accumulated = await self.accumulation_result()
+            result["accumulated_frames"] = accumulated["count"] if accumulated else 0
+        if self.peak_fitter.enabled:
+            # the fits lag the acquisition, so the step waits for them to catch up
+            while self.analysing:
+                await asyncio.sleep(0.01)
+            result["peaks"] = dict(self.peaks, frame_number=self.peak_frame_number)
+        return result
+
+    async def write_settings(self, settings):
+        # in one batch if the bridge can, otherwise one by one through the parameter tree
+        if await self.apply_settings(settings):
+            return
+        for branch, names in self.SETTINGS_TREE.items():
+            for name in names:
+                if name in settings:
+                    await self.param_tree.set("{}/{}".format(branch, name), settings[name])
+
+    def acquire_reference(self, kind, frames):
+        """
+        Start taking a dark or flat field for the current settings.
+        kind: "dark" or "flat"
+        frames: number of frames to average
+        """
+        if self.acquiring:
+            logging.warning("Acquisition already in progress, ignoring request for a %s", kind)
+            return
+        self.acquiring = True
+        self.settings_cache.invalidate()
+        self.acquire_task = asyncio.ensure_future(self.capture_reference(kind, max(frames, 1)))
+
+    async def capture_reference(self, kind, num_frames):
+        # the frames are summed as they arrive, rather than kept, and averaged at the end
+        try:
+            settings = await self.read_acquisition_settings()
+            if kind == "dark":
+                shutter_mode = await self.close_shutter()
+            frame_sum = None
+            count = 0
+            try:
+                async for frames, timestamp in self.capture_frames(num_frames):
+                    burst_sum = frames.sum(axis=0, dtype=np.float64)
+                    frame_sum = burst_sum if frame_sum is None else frame_sum + burst_sum
+                    count += len(frames)
+            finally:
+                if kind == "dark":
+                    await self.restore_shutter(shutter_mode)
+            if count:
+                if kind == "dark":
+                    self.corrector.add_dark(frame_sum, count, settings)
+                else:
+                    self.corrector.add_flat(frame_sum, count, settings)
+        except (LostRemote, TimeoutExpired) as remote_err:
+            logging.error("Remote Error taking %s: %s", kind, remote_err)
+        except asyncio.CancelledError:
+            raise
+        except Exception as err:
+            logging.error("Error taking %s: %s", kind, err)
+        finally:
+            self.acquiring = False
+
+    async def close_shutter(self):
+        """
+        Hold the shutter closed, e.g. while taking darks.
+        returns: the shutter mode it was in, to be restored after, or None if the bridge can't
+        report it
+        """
+        try:
+            mode = await self.client.get_shutter_mode()
+        except RemoteError as remote_err:
+            if remote_err.name != "NameError":
+                raise
+            mode = None
+        try:
+            await self.client.set_shutter_closed(True)
+        except RemoteError as remote_err:
+            if remote_err.name != "NameError":
+                raise
+            logging.warning("Bridge can't control the shutter, make sure no light reaches the "
+                            "sensor while taking darks")
+        return mode
+
+    async def restore_shutter(self, mode):
+        # put the shutter back in the mode it was in, or in normal operation if that isn't known
+        try:
+            if mode is None:
+                await self.client.set_shutter_closed(False)
             else:
-                img = ax1.imshow(data)
-                fig.colorbar(img)
-            
-            self.rendered_graph = io.BytesIO()
-            fig.savefig(self.rendered_graph, format='png')
-            self.rendered_graph.seek(0)
+                await self.client.set_shutter_mode(mode)
+        except RemoteError as remote_err:
+            if remote_err.name != "NameError":
+                raise
+
+    def set_correction_enabled(self, value):
+        self.corrector.enabled = bool(value)
+
+    def set_flat_enabled(self, value):
+        self.corrector.flat_enabled = bool(value)
 
+    async def set_preview(self, value):
+        if not value:
+            if self.previewing:
+                # the bridge ends the stream once the experiment has stopped
+                try:
+                    await self.client.stop_acquire()
+                except (LostRemote, TimeoutExpired) as remote_err:
+                    logging.error("Remote Error trying to stop preview: %s", remote_err)
+            return
+        if self.acquiring:
+            logging.warning("Acquisition already in progress, ignoring request to preview")
+            return
+        self.acquiring = True
+        self.previewing = True
+        self.frames_dropped = 0
+        self.run_settings = None
+        self.settings_cache.invalidate()
+        self.acquire_task = asyncio.ensure_future(self.preview_frames())
+
+    async def preview_frames(self):
+        # Frames are pushed by the bridge as LightField delivers them, so the preview runs at
+        # the camera's frame rate. Only one frame is in flight at a time; if the adapter falls
+        # behind, the bridge drops the oldest frames it is holding rather than queueing them.
+        try:
+            self.run_settings = await self.read_acquisition_settings()
+            async for frame_data in self.client.stream(
+                    "stream_frames", "preview", self.stream_queue_frames):
+                timestamp = time.time()
+                frames = await self.decode_frame_data(frame_data)
+                self.frames_dropped = frame_data.get("dropped", 0)
+                # settings can be changed while previewing, so each frame is recorded with
+                # the latest values known
+                self.run_settings.update(self.settings_cache.values)
+                await self.frames_acquired(frames, timestamp)
+        except RemoteError as remote_err:
+            if remote_err.name == "NameError":
+                logging.warning("Bridge does not support streaming frames, preview unavailable")
+            else:
+                logging.error("Remote Error in preview: %s", remote_err)
         except (LostRemote, TimeoutExpired) as remote_err:
-            logging.error("Remote Error in get_data: %s", remote_err)
+            logging.error("Remote Error in preview: %s", remote_err)
+        except asyncio.CancelledError:
+            raise
+        except Exception as err:
+            logging.error("Error previewing frame: %s", err)
         finally:
-            if frames != 0:
-                IOLoop.current().call_later(0.5, self.get_frame_from_spectrometer, frames - 1)
+            self.previewing = False
+            self.acquiring = False
 
-    def get_binning_mode(self):
-      
+    async def frames_acquired(self, frames, timestamp):
+        self.settings_cache.update(self.run_settings)
+        wavelength = await self.get_calibration(self.run_settings, frames.shape[-1])
+        correct = self.corrector.correction(self.run_settings, frames.shape[1:])
+        # the frames are corrected once, into a new array shared by the buffer, accumulator,
+        # peak fits and preview, so it can't be overwritten while any of them are using it
+        corrected = None if correct is None else self.corrected_frames(frames, correct)
+        frame_number = self.store_frames(frames, timestamp, wavelength, corrected)
+        # the settings are copied, as they can be updated while the writer is catching up
+        self.writer.write(frames, frame_number - len(frames) + 1, timestamp,
+                          dict(self.run_settings))
+        processed = frames if corrected is None else corrected
+        if self.accumulator.enabled and not self.accumulator.complete:
+            self.accumulate(processed, wavelength)
+        if self.peak_fitter.enabled and frames.shape[1] == 1:
+            self.analyse_peaks(processed, frame_number, wavelength)
+        self.render_frame(processed[-1], frame_number, timestamp, wavelength)
+
+    def store_frames(self, frames, timestamp, wavelength=None, corrected=None):
+        # returns the frame number of the last frame stored
+        first_frame_number = self.frame_number + 1
+        self.frame_number += len(frames)
+        self.frame_buffer.extend(frames, first_frame_number, timestamp, self.run_settings,
+                                 wavelength, corrected)
+        return self.frame_number
+
+    async def get_calibration(self, settings, width):
+        """
+        Get the wavelength axis for frames taken with the given settings. The axis is only
+        read from the bridge the first time a combination of settings is seen, so it costs
+        nothing per frame.
+        settings: dict of the settings the frames were taken with
+        width: number of columns in the frames
+        returns: read-only array of the wavelength of each column, or None if not calibrated
+        """
+        key = tuple(settings.get(name) for name in self.CALIBRATION_SETTINGS) + (width,)
+        if key == self.calibration_key:
+            return self.calibration
+
+        if key in self.calibration_axes:
+            self.calibration_axes.move_to_end(key)
+        else:
+            try:
+                axis = await self.client.get_calibration_x_axis()
+            except (LostRemote, TimeoutExpired, RemoteError) as remote_err:
+                # not remembered, so it is tried again for the next frame
+                logging.error("Remote Error trying to get calibration: %s", remote_err)
+                return None
+            self.calibration_axes[key] = self.fit_calibration(axis, width)
+            if len(self.calibration_axes) > self.calibration_axes_size:
+                self.calibration_axes.popitem(last=False)
+
+        self.calibration_key = key
+        self.calibration = self.calibration_axes[key]
+        return self.calibration
+
+    def fit_calibration(self, axis, width):
+        # the axis may cover the unbinned sensor, in which case binned columns are given the
+        # mean wavelength of the pixels in them
+        if not axis:
+            return None
+        axis = np.asarray(axis, dtype=np.float64)
+        if len(axis) != width:
+            bins = len(axis) // width
+            if bins < 1:
+                logging.warning("Calibration has %d points for %d columns, ignoring it",
+                                len(axis), width)
+                return None
+            axis = axis[:width * bins].reshape(width, bins).mean(axis=1)
+        axis.flags.writeable = False
+        return axis
+
+    def accumulate(self, frames, wavelength):
+        # frames are accumulated corrected if they can be, and on the executor so that large
+        # bursts don't hold up the event loop. The result is also read on the executor, so it
+        # is never seen part way through an update
+        self.accumulated_wavelength = wavelength
+        IOLoop.current().add_future(self.accumulate_frames(frames), self.frames_accumulated)
+
+    def corrected_frames(self, frames, correct):
+        # a corrected copy of the frames, or the frames themselves if there is no correction
+        if correct is None:
+            return frames
+        corrected = np.empty(frames.shape, dtype=np.float32)
+        correct(frames, out=corrected)
+        return corrected
+
+    def frames_accumulated(self, future):
         try:
-            return self.client.get_region_of_interest()
+            future.result()
+        except Exception as err:
+            logging.error("Error accumulating frames: %s", err)
+
+    @run_on_executor
+    def accumulate_frames(self, frames):
+        self.accumulator.add(frames)
+
+    @run_on_executor
+    def accumulation_result(self):
+        return self.accumulator.result()
+
+    async def get_accumulation_result(self):
+        result = await self.accumulation_result()
+        if result is None:
+            raise ValueError("No frames have been accumulated")
+        return result
+
+    async def get_accumulated_image(self, quantity):
+        """
+        Get a plot of the accumulated mean or its signal to noise ratio, rendering it only if
+        more frames have been accumulated since it was last asked for.
+        quantity: 'accumulated' for the mean, or 'snr'
+        returns: the PNG encoded image
+        """
+        names = {"accumulated": "mean", "snr": "snr"}
+        if quantity not in names:
+            raise ValueError("Unknown image {}, expected accumulated or snr".format(quantity))
+        count, image = self.accumulated_images.get(quantity, (None, None))
+        if count != self.accumulator.count or image is None:
+            result = await self.get_accumulation_result()
+            image, etag = await self.render_graph(result[names[quantity]],
+                                                  self.accumulated_wavelength)
+            self.accumulated_images[quantity] = (result["count"], image)
+        return image
+
+    def set_accumulation_enabled(self, value):
+        self.accumulator.enabled = bool(value)
+
+    def set_accumulation_target(self, value):
+        self.accumulator.target_frames = max(int(value), 0)
+
+    def reset_accumulation(self, value=None):
+        self.executor.submit(self.accumulator.reset)
+
+    def set_peaks_enabled(self, value):
+        self.peak_fitter.enabled = bool(value)
+
+    async def set_peak_option(self, name, value):
+        # changed on the analysis executor, so a fit never sees its options change part way
+        # through, and the last fits are forgotten as they may no longer be a good start
+        def set_option():
+            setattr(self.peak_fitter, name, value)
+            self.peak_fitter.reset()
+        await asyncio.wrap_future(self.analysis_executor.submit(set_option))
+
+    def reset_peaks(self, value=None):
+        self.analysis_executor.submit(self.peak_fitter.reset)
+
+    def analyse_peaks(self, frames, last_frame_number, wavelength):
+        # as with rendering, only the newest frames waiting to be fitted are kept, so the
+        # fits skip frames rather than fall behind if the acquisition is too fast for them
+        if self.analysing:
+            if self.analysis_pending is not None:
+                self.peak_frames_skipped += len(self.analysis_pending[0])
+            self.analysis_pending = (frames, last_frame_number, wavelength)
+            return
+        self.analysing = True
+        IOLoop.current().add_future(self.fit_peaks(frames, wavelength),
+                                    partial(self.peaks_fitted, last_frame_number))
+
+    @run_on_executor(executor='analysis_executor')
+    def fit_peaks(self, frames, wavelength):
+        # every spectrum is fitted, in order, so each fit starts from the one before
+        start = time.perf_counter()
+        for frame in frames:
+            peaks = self.peak_fitter.analyse(frame[0], wavelength)
+        return peaks, (time.perf_counter() - start) / len(frames), len(frames)
+
+    def peaks_fitted(self, frame_number, future):
+        self.analysing = False
+        try:
+            self.peaks, fit_time, num_frames = future.result()
+            self.peak_frame_number = frame_number
+            self.peak_frames_fitted += num_frames
+            self.peak_fit_time = fit_time * 1000
+        except Exception as err:
+            logging.error("Error fitting peaks: %s", err)
+
+        if self.analysis_pending is not None:
+            pending, self.analysis_pending = self.analysis_pending, None
+            self.analyse_peaks(*pending)
+
+    def render_frame(self, data, frame_number, timestamp, wavelength=None):
+        # only the newest frame waiting to be drawn is kept, so a slow render skips
+        # frames rather than falling further and further behind the acquisition
+        if self.rendering:
+            self.render_pending = (data, frame_number, timestamp, wavelength)
+            return
+        self.rendering = True
+        IOLoop.current().add_future(
+            self.render_graph(data, wavelength),
+            partial(self.frame_rendered, frame_number, timestamp, data.shape)
+        )
+
+    def frame_rendered(self, frame_number, timestamp, shape, future):
+        self.rendering = False
+        try:
+            self.rendered_graph, self.rendered_etag = future.result()
+            self.rendered_frame_number = frame_number
+            if self.publisher:
+                self.publisher.publish(frame_number, timestamp, shape, self.rendered_graph)
+        except Exception as err:
+            logging.error("Error rendering frame: %s", err)
+
+        if self.render_pending is not None:
+            pending, self.render_pending = self.render_pending, None
+            self.render_frame(*pending)
+
+    @run_on_executor
+    def decode_frame_data(self, frame_data):
+        return decode_frames(frame_data)
+
+    @run_on_executor
+    def encode_frame_image(self, data, content_type, max_shape):
+        # encoded on the decoding executor, so it isn't held up by figures being drawn
+        return self.image_encoder.encode(reduce_image(data, max_shape), content_type)
+
+    @run_on_executor(executor='render_executor')
+    def render_graph(self, data, wavelength=None, size=None):
+        image = self.renderer.render(data, wavelength, size)
+        etag = '"{}"'.format(hashlib.sha1(image).hexdigest())
+        return image, etag
+
+    async def read_acquisition_settings(self):
+        values = await self.fetch_settings()
+        if values is not None:
+            return values
+        # the individual reads are independent, so they are all sent at once
+        names = ("exposure", "grating", "centre_wavelength", "binning_mode",
+                 "row_bin_centre", "bin_width", "bin_height")
+        values = await asyncio.gather(
+            self.client.get_camera_exposure(),
+            self.client.get_grating(),
+            self.client.get_centre_wavelength(),
+            self.client.get_region_of_interest(),
+            self.client.get_line_bin_row(),
+            self.client.get_num_columns_binned(),
+            self.client.get_num_rows_binned()
+        )
+        return dict(zip(names, values))
+
+    async def acquire_frame_data(self, frames):
+        if self.binary_frames:
+            try:
+                return await self.client.start_acquire_binary(frames, timeout=self.acquire_timeout)
+            except RemoteError as remote_err:
+                if remote_err.name != "NameError":
+                    raise
+                logging.warning("Bridge does not support binary frames, using list format")
+                self.binary_frames = False
+        # the list format only holds the first frame, so capture them one at a time
+        return await self.client.start_acquire(1, timeout=self.acquire_timeout)
+
+    async def get_binning_mode(self):
+
+        try:
+            return await self.client.get_region_of_interest()
         except (LostRemote, TimeoutExpired) as remote_err:
             logging.error("Remote Error trying to Get Binning Mode: %s", remote_err)
 
-    def set_binning_mode(self, value):
+    async def set_binning_mode(self, value):
 
         try:
-            self.client.set_region_of_interest(value)
+            await self.client.set_region_of_interest(value)
         except (LostRemote, TimeoutExpired) as remote_err:
             logging.error("Remote Error trying to Set Binning Mode: %s", remote_err)
 
-    def get_row_bin_centre(self):
-        
+    async def get_row_bin_centre(self):
+
         try:
-            return self.client.get_line_bin_row()
+            return await self.client.get_line_bin_row()
         except (LostRemote, TimeoutExpired) as remote_err:
             logging.error("Remote Error: %s", remote_err)
 
-    def set_row_bin_centre(self, value):
-    
+    async def set_row_bin_centre(self, value):
+
         try:
-            self.client.set_line_bin_row(value)
+            await self.client.set_line_bin_row(value)
         except (LostRemote, TimeoutExpired) as remote_err:
             logging.error("Remote Error: %s", remote_err)
 
-    def get_bin_width(self):
+    async def get_bin_width(self):
         try:
-            return self.client.get_num_columns_binned()
+            return await self.client.get_num_columns_binned()
         except (LostRemote, TimeoutExpired) as remote_err:
             logging.error("Remote Error: %s", remote_err)
 
-    def set_bin_width(self, value):
+    async def set_bin_width(self, value):
         try:
-            self.client.set_num_columns_binned(value)
+            await self.client.set_num_columns_binned(value)
         except (LostRemote, TimeoutExpired) as remote_err:
             logging.error("Remote Error: %s", remote_err)
 
-    def get_bin_height(self):
+    async def get_bin_height(self):
         try:
-            return self.client.get_num_rows_binned()
+            return await self.client.get_num_rows_binned()
         except (LostRemote, TimeoutExpired) as remote_err:
             logging.error("Remote Error: %s", remote_err)
 
-    def set_bin_height(self, value):
+    async def set_bin_height(self, value):
         try:
-            self.client.set_num_rows_binned(value)
+            await self.client.set_num_rows_binned(value)
         except (LostRemote, TimeoutExpired) as remote_err:
             logging.error("Remote Error: %s", remote_err)
 
-    def get_exposure(self):
+    async def get_exposure(self):
         try:
-            return self.client.get_camera_exposure()
+            return await self.client.get_camera_exposure()
         except (LostRemote, TimeoutExpired) as remote_err:
             logging.error("Remote Error: %s", remote_err)
 
-    def set_exposure(self, value):
+    async def set_exposure(self, value):
         try:
-            self.client.set_camera_exposure(value)
+            await self.client.set_camera_exposure(value)
         except (LostRemote, TimeoutExpired) as remote_err:
             logging.error("Remote Error: %s", remote_err)
 
-    def get_centre_wavelength(self):
+    async def get_centre_wavelength(self):
         try:
-            return self.client.get_centre_wavelength()
+            return await self.client.get_centre_wavelength()
         except (LostRemote, TimeoutExpired) as remote_err:
             logging.error("Remote Error: %s", remote_err)
 
-    def set_centre_wavelength(self, value):
+    async def set_centre_wavelength(self, value):
         try:
-            self.client.set_centre_wavelength(value)
+            await self.client.set_centre_wavelength(value)
         except (LostRemote, TimeoutExpired) as remote_err:
             logging.error("Remote Error: %s", remote_err)
@@ -0,0 +1,339 @@
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from concurrent import futures
+
+import numpy as np
+
+# resolution in seconds of each table of rollups
+ROLLUPS = (1, 60, 3600)
+
+# how long each table is kept by default, in seconds, keyed by "raw" or the rollup resolution
+DEFAULT_RETENTION = {
+    "raw": 2 * 24 * 3600,
+    1: 7 * 24 * 3600,
+    60: 365 * 24 * 3600,
+    3600: 10 * 365 * 24 * 3600
+}
+
+
+class TelemetryError(Exception):
+    """Raised when the telemetry store can't answer a query."""
+
+
+class TelemetryStore:
+    """
+    Stores timestamped readings of a set of channels in a SQLite database on a background thread.
+
+    Readings are handed over through a bounded queue, and inserted in batches once every
+    flush_interval seconds, so the database is written a few times a minute however fast the
+    readings come. Each reading is kept as it is in the raw table, with a column per channel,
+    and rolled up into tables of 1 second, 1 minute and 1 hour buckets holding the minimum,
+    maximum, sum and count of each channel. Rollups are merged into any bucket already stored,
+    so a bucket split across batches, or across restarts, comes out the same.
+
+    Each table is keyed on its time, so time range queries are a search of the primary key, and
+    each has its own retention period, past which old rows are deleted. SQLite reuses the space
+    they leave, so once every table has filled its retention period the file stops growing.
+    Queries read from the coarsest table that still gives the resolution asked for, so the
+    number of rows a query reads doesn't grow with the span of time it covers.
+    """
+
+    def __init__(self, path, channels, retention=None, flush_interval=5.0, queue_size=10000,
+                 prune_interval=600):
+        """
+        path: path of the SQLite database file, created if it doesn't exist
+        channels: names of the channels, which must be valid identifiers
+        retention: dict of how long to keep each table in seconds, keyed by "raw" or the
+        resolution of a rollup, None to keep it forever. Defaults to DEFAULT_RETENTION
+        flush_interval: longest time in seconds readings wait before being written
+        queue_size: number of readings and queries that can be waiting before readings are
+        dropped
+        prune_interval: time in seconds between deletions of rows past their retention
+        """
+        self.channels = tuple(channels)
+        invalid = [channel for channel in self.channels if not channel.isidentifier()]
+        if invalid:
+            raise ValueError("Invalid telemetry channel names: {}".format(", ".join(invalid)))
+        self.path = path
+        self.retention = dict(DEFAULT_RETENTION)
+        self.retention.update(retention or {})
+        self.flush_interval = flush_interval
+        self.prune_interval = prune_interval
+
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.readings_written = 0
+        self.readings_dropped = 0
+        self.error = None
+
+        # only used by the store thread
+        self.connection = None
+        self.pending = []
+        self.pending_since = None
+        self.last_prune = 0
+
+        self.thread = threading.Thread(target=self._run, name="TelemetryStore", daemon=True)
+        self.thread.start()
+
+    def append(self, timestamp, readings):
+        """
+        Queue a reading to be stored.
+        timestamp: time of the reading, in seconds since the epoch
+        readings: dict of the value of each channel read, others are stored as NULL
+        """
+        try:
+            self.queue.put_nowait(("append", (timestamp, readings)))
+        except queue.Full:
+            self.readings_dropped += 1
+            logging.warning("Telemetry store is falling behind, dropped a reading")
+
+    def query(self, channels=None, start=None, end=None, max_points=500):
+        """
+        Get the readings of some channels over a span of time, downsampled to buckets of equal
+        time. Any readings still waiting to be written are written first.
+        channels: names of the channels to get, defaults to all of them
+        start: earliest time to get, in seconds since the epoch, or counting back from now if
+        negative. Defaults to the oldest reading stored
+        end: latest time to get, as start. Defaults to now
+        max_points: most buckets to return, empty ones are left out
+        returns: a Future of a dict of the time of each bucket, the resolution in seconds of
+        the table read (0 for the raw readings), the width of the buckets and, for each
+        channel, the minimum, maximum and mean of each bucket. Missing readings are None
+        raises: TelemetryError if a channel isn't stored
+        """
+        channels = list(self.channels if channels is None else channels)
+        unknown = set(channels) - set(self.channels)
+        if unknown:
+            raise TelemetryError("Unknown telemetry channels: {}".format(
+                ", ".join(sorted(unknown))))
+        future = futures.Future()
+        self.queue.put(("query", (future, channels, start, end, max(int(max_points), 1))))
+        return future
+
+    def stop(self):
+        self.queue.put(None)
+        self.thread.join()
+
+    def _run(self):
+        try:
+            self._open()
+        except sqlite3.Error as err:
+            logging.error("Error opening telemetry store %s: %s", self.path, err)
+            self.error = str(err)
+            self.connection = None
+        while True:
+            timeout = None
+            if self.pending:
+                timeout = max(self.pending_since + self.flush_interval - time.time(), 0)
+            try:
+                command = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                command = ("flush", None)
+            if command is None:
+                break
+            action, args = command
+            if action == "query":
+                future = args[0]
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    self._flush()
+                    future.set_result(self._query(*args[1:]))
+                except (sqlite3.Error, TelemetryError) as err:
+                    future.set_exception(TelemetryError(str(err)))
+                continue
+            if action == "append":
+                if not self.pending:
+                    self.pending_since = time.time()
+                self.pending.append(args)
+                if time.time() < self.pending_since + self.flush_interval:
+                    continue
+            self._flush()
+        self._flush()
+        if self.connection is not None:
+            self.connection.close()
+
+    def _open(self):
+        self.connection = sqlite3.connect(self.path)
+        # the write ahead log lets batches be committed without rewriting the database, and
+        # only syncing at checkpoints is safe against a crash of the process
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        columns = {"raw": ["{} REAL".format(channel) for channel in self.channels]}
+        for resolution in ROLLUPS:
+            columns[self._table(resolution)] = [
+                "{}_{} {}".format(channel, field, kind) for channel in self.channels
+                for field, kind in (("min", "REAL"), ("max", "REAL"), ("sum", "REAL DEFAULT 0"),
+                                    ("count", "INTEGER DEFAULT 0"))]
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS raw "
+                                    "(time REAL PRIMARY KEY) WITHOUT ROWID")
+            for resolution in ROLLUPS:
+                self.connection.execute("CREATE TABLE IF NOT EXISTS {} "
+                                        "(time INTEGER PRIMARY KEY)".format(
+                                            self._table(resolution)))
+            # channels added since the database was created get new columns
+            for table, table_columns in columns.items():
+                existing = {row[1] for row in self.connection.execute(
+                    "PRAGMA table_info({})".format(table))}
+                for column in table_columns:
+                    if column.split()[0] not in existing:
+                        self.connection.execute("ALTER TABLE {} ADD COLUMN {}".format(
+                            table, column))
+
+    @staticmethod
+    def _table(resolution):
+        return "raw" if not resolution else "rollup_{}".format(resolution)
+
+    def _flush(self):
+        if not self.pending or self.connection is None:
+            self.pending = []
+            return
+        pending = sorted(self.pending, key=lambda reading: reading[0])
+        self.pending = []
+        times = np.array([timestamp for timestamp, _ in pending], dtype=np.float64)
+        values = np.array([[readings.get(channel, np.nan) for channel in self.channels]
+                           for _, readings in pending], dtype=np.float64)
+        try:
+            with self.connection:
+                self._insert_raw(times, values)
+                for resolution in ROLLUPS:
+                    self._merge_rollup(resolution, times, values)
+            self.readings_written += len(times)
+        except sqlite3.Error as err:
+            logging.error("Error writing to telemetry store %s: %s", self.path, err)
+            self.error = str(err)
+        if time.time() - self.last_prune >= self.prune_interval:
+            self._prune()
+
+    def _insert_raw(self, times, values):
+        sql = "INSERT OR REPLACE INTO raw (time, {}) VALUES (?{})".format(
+            ", ".join(self.channels), ", ?" * len(self.channels))
+        rows = [[timestamp] + [self._nullable(value) for value in row]
+                for timestamp, row in zip(times.tolist(), values.tolist())]
+        self.connection.executemany(sql, rows)
+
+    def _merge_rollup(self, resolution, times, values):
+        buckets = np.floor(times / resolution).astype(np.int64) * resolution
+        starts = np.flatnonzero(np.diff(buckets, prepend=buckets[0] - 1))
+        valid = ~np.isnan(values)
+        low = np.fmin.reduceat(values, starts, axis=0)
+        high = np.fmax.reduceat(values, starts, axis=0)
+        total = np.add.reduceat(np.where(valid, values, 0), starts, axis=0)
+        count = np.add.reduceat(valid.astype(np.int64), starts, axis=0)
+
+        columns = []
+        updates = []
+        for channel in self.channels:
+            names = ["{}_{}".format(channel, field) for field in ("min", "max", "sum", "count")]
+            columns.extend(names)
+            # scalar min and max are NULL if either side is, so NULLs are replaced by the other
+            for name, merge in zip(names, ("min", "max")):
+                updates.append("{0} = {1}(coalesce({0}, excluded.{0}), "
+                               "coalesce(excluded.{0}, {0}))".format(name, merge))
+            for name in names[2:]:
+                updates.append("{0} = {0} + excluded.{0}".format(name))
+        sql = "INSERT INTO {} (time, {}) VALUES (?{}) ON CONFLICT(time) DO UPDATE SET {}".format(
+            self._table(resolution), ", ".join(columns), ", ?" * len(columns),
+            ", ".join(updates))
+
+        rows = []
+        for index, bucket in enumerate(buckets[starts].tolist()):
+            row = [bucket]
+            for channel in range(len(self.channels)):
+                row.extend([self._nullable(low[index, channel]),
+                            self._nullable(high[index, channel]),
+                            float(total[index, channel]), int(count[index, channel])])
+            rows.append(row)
+        self.connection.executemany(sql, rows)
+
+    @staticmethod
+    def _nullable(value):
+        # NaN is stored as NULL, so that SQL aggregates skip it
+        return None if value != value else float(value)
+
+    def _prune(self):
+        self.last_prune = time.time()
+        try:
+            with self.connection:
+                for resolution in (None,) + ROLLUPS:
+                    retention = self.retention.get(resolution or "raw")
+                    if retention is not None:
+                        self.connection.execute(
+                            "DELETE FROM {} WHERE time < ?".format(self._table(resolution)),
+                            (self.last_prune - retention,))
+        except sqlite3.Error as err:
+            logging.error("Error pruning telemetry store %s: %s", self.path, err)
+            self.error = str(err)
+
+    def _query(self, channels, start, end, max_points):
+        if self.connection is None:
+            raise TelemetryError("Telemetry store is not open")
+        now = time.time()
+        end = now if end is None else (now + end if end < 0 else end)
+        if start is None:
+            start = self._oldest()
+            start = end if start is None else start
+        elif start < 0:
+            start = now + start
+        width = max((end - start) / max_points, 1e-6)
+
+        # the coarsest table no coarser than the buckets, out of those still going back as far
+        # as the start, or the finest of those if they are all coarser
+        held = [resolution for resolution in (None,) + ROLLUPS
+                if self._holds(resolution, start, now)] or [ROLLUPS[-1]]
+        fine = [resolution for resolution in held if (resolution or 0) <= width]
+        resolution = fine[-1] if fine else held[0]
+
+        if resolution is None:
+            selected = ["min({0}), max({0}), avg({0})".format(channel) for channel in channels]
+            present = " + ".join("count({})".format(channel) for channel in channels)
+            first = start
+            centre = 0
+        else:
+            selected = ["min({0}_min), max({0}_max), sum({0}_sum) / sum({0}_count)".format(
+                channel) for channel in channels]
+            present = " + ".join("sum({}_count)".format(channel) for channel in channels)
+            # rollups are keyed on the start of their bucket, and reported at its centre
+            first = start // resolution * resolution
+            centre = resolution / 2
+        # a little wider than the span divided up, so that a reading at the end doesn't start
+        # a bucket of its own
+        width = max((end - first) / max_points * (1 + 1e-9), resolution or 1e-6)
+        sql = ("SELECT CAST((time - ?) / ? AS INTEGER) AS bucket, avg(time), {} FROM {} "
+               "WHERE time >= ? AND time <= ? GROUP BY bucket HAVING {} > 0 "
+               "ORDER BY bucket").format(", ".join(selected), self._table(resolution), present)
+        rows = self.connection.execute(sql, (first, width, first, end)).fetchall()
+
+        return {
+            "time": [row[1] + centre for row in rows],
+            "resolution": resolution or 0,
+            "bucket": width,
+            "channels": {
+                channel: {
+                    "min": [row[2 + 3 * index] for row in rows],
+                    "max": [row[3 + 3 * index] for row in rows],
+                    "mean": [row[4 + 3 * index] for row in rows]
+                } for index, channel in enumerate(channels)
+            }
+        }
+
+    def _oldest(self):
+        # the time of the oldest reading stored, which the primary keys give straight away.
+        # Rollups are keyed on the start of their bucket, so the oldest bucket of each table is
+        # narrowed down by the finer tables, where they start within it
+        oldest = None
+        width = None
+        for resolution in ROLLUPS[::-1] + (None,):
+            value = self.connection.execute("SELECT min(time) FROM {}".format(
+                self._table(resolution))).fetchone()[0]
+            if value is not None and (oldest is None or value < oldest + width):
+                oldest = value if oldest is None else max(oldest, value)
+            width = resolution
+        return oldest
+
+    def _holds(self, resolution, start, now):
+        retention = self.retention.get(resolution or "raw")
+        return retention is None or start >= now - retention
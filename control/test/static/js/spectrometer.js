@@ -1,5 +1,8 @@
 api_version = '0.1';
 adapter_name = 'zerorpc';
+poll_timer = null;
+image_url = null;
+image_etag = null;
 
 $(document).ready(function() {
 
@@ -11,7 +14,7 @@ $(document).ready(function() {
 function init() {
 
     img_elem = $('#data_img')
-    setInterval(updateImage, 500);
+    connectFramePush();
     $("[name='btnradio_bin']").on('click', (function(e)
     {
         console.log("Radio Changed: " + e.type);
@@ -64,8 +67,79 @@ function acquire() {
     });
 }
 
+function togglePreview() {
+    // starts LightField's preview, with frames streamed from the bridge as they are taken,
+    // or stops it if it is already running
+    $.getJSON('/api/' + api_version + '/' + adapter_name + '/preview', function(data) {
+        $.ajax({type: "PUT",
+                url: '/api/' + api_version + '/' + adapter_name,
+                contentType: "application/json",
+                data: JSON.stringify({'preview': !data.preview}),
+            success: function(data) {
+                $("#btn-preview").text(data.preview ? "Stop Preview" : "Preview");
+            }
+        });
+    });
+}
+
+function connectFramePush() {
+    // new frames are pushed over a WebSocket as they are rendered, falling back to polling
+    // the image if the push server is disabled or can't be reached
+    $.getJSON('/api/' + api_version + '/' + adapter_name + '/push_port', function(data) {
+        if (!data.push_port || !window.WebSocket) {
+            startPolling();
+            return;
+        }
+        socket = new WebSocket('ws://' + window.location.hostname + ':' + data.push_port + '/frames?mode=image');
+        socket.binaryType = 'blob';
+        socket.onopen = function() {
+            console.log("Frame push connected");
+            stopPolling();
+        };
+        socket.onmessage = function(event) {
+            showImage(event.data);
+        };
+        socket.onclose = function() {
+            console.log("Frame push disconnected");
+            startPolling();
+            setTimeout(connectFramePush, 5000);
+        };
+    }).fail(startPolling);
+}
+
+function showImage(blob) {
+    if (image_url) {
+        URL.revokeObjectURL(image_url);
+    }
+    image_url = URL.createObjectURL(blob);
+    img_elem.attr("src", image_url);
+}
+
+function startPolling() {
+    if (poll_timer === null) {
+        poll_timer = setInterval(updateImage, 500);
+    }
+}
+
+function stopPolling() {
+    if (poll_timer !== null) {
+        clearInterval(poll_timer);
+        poll_timer = null;
+    }
+}
+
 function updateImage() {
-    img_start_time = new Date().getTime();
-    img_elem.attr("src", img_elem.attr("data-src") + '?' + img_start_time);
-    console.log("Image Updated");
+    // a conditional request: the browser revalidates its cached copy with If-None-Match and
+    // gets an empty 304 back if the image hasn't changed, so an idle spectrometer costs nothing
+    fetch(img_elem.attr("data-src"), {cache: "no-cache"}).then(function(response) {
+        etag = response.headers.get("ETag");
+        if (!response.ok || (etag && etag === image_etag)) {
+            return;
+        }
+        image_etag = etag;
+        return response.blob().then(function(blob) {
+            showImage(blob);
+            console.log("Image Updated");
+        });
+    });
 }
\ No newline at end of file